@@ -0,0 +1,331 @@
+## Python script with an asyncio engine to scrape the rental property data from domain.com, ##
+## reusing one pooled HTTP session instead of opening a new connection for every page ##
+
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from tqdm import tqdm
+from scripts.parallelised_scrape import HEADERS, build_search_url
+from scripts.parallelised_scrape import MAX_PAGES, RESULTS_PER_PAGE, price_bands, format_price_range
+from scripts.parallelised_scrape import split_price_band, num_result_pages
+from scripts.crawl_journal import page_validators
+from scripts.listing_parsers import get_parser
+from scripts.rate_limiter import get_limiter, retry_after_seconds
+
+
+############################## SESSION, CONCURRENCY AND RATE LIMITING ##############################
+
+class AsyncScraper:
+    '''
+    Holds a pooled aiohttp session that keeps connections alive between requests.
+    'max_per_host' caps the number of concurrent connections to any one host, and every
+    request waits for the host's shared rate limiter (see rate_limiter.configure_host to
+    change a host's rate). Pages are parsed with
+    the given parser backend (see listing_parsers.get_parser), and property pages are saved
+    to the given PageCache, if any.
+    Use as 'async with AsyncScraper(...) as scraper:'
+    '''
+
+    def __init__(self, max_per_host=20, timeout=30, parser=None, cache=None):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.parser = get_parser(parser)
+        self.cache = cache
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.max_per_host, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def fetch_page(self, url, headers=None):
+        '''
+        Fetches the given url over the pooled session (with any extra request headers) and 
+        returns the status code, page html and response headers
+        '''
+
+        limiter = get_limiter(url)
+        await limiter.wait_async()
+
+        async with self.session.get(url, headers=headers) as response:
+            # Let the limiter speed up or back off based on how the server answered
+            limiter.record(response.status, retry_after_seconds(response.headers))
+            response.raise_for_status()
+            return response.status, await response.text(), dict(response.headers)
+
+    async def fetch_text(self, url):
+        '''
+        Fetches the given url over the pooled session and returns the page html
+        '''
+
+        return (await self.fetch_page(url))[1]
+
+
+
+def run_sync(coro):
+    '''
+    Runs the given coroutine to completion and returns its result. Jupyter already runs an
+    event loop, so in that case the coroutine is run on its own loop in a separate thread
+    '''
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+############################## FUNCTIONS TO FIND ALL THE RENTAL URLS ##############################
+
+async def fetch_links_for_price_range_async(scraper, baseurl, price_range, page):
+    '''
+    Fetches the links from a given page for a specific price range.
+    '''
+
+    url = build_search_url(baseurl, price_range, page)
+
+    try:
+        html = await scraper.fetch_text(url)
+        doc = scraper.parser.parse(html)
+    except Exception as e:
+        print(f"Error fetching page {page} for price range {price_range}: {e}")
+        return []
+
+    links = scraper.parser.listing_links(doc, baseurl)
+    return links or []
+
+
+
+async def partition_price_band_async(scraper, baseurl, min_price, max_price):
+    '''
+    Reads the listing count for a price band from its first page and splits the band in 
+    half recursively until every part fits under the page cap. Returns a list of 
+    (price_range, total_listings, first_page_links) for the final bands
+    '''
+
+    price_range = format_price_range(min_price, max_price)
+    check_url = build_search_url(baseurl, price_range)
+
+    try:
+        html = await scraper.fetch_text(check_url)
+        doc = scraper.parser.parse(html)
+    except Exception as e:
+        print(f"Error fetching page {check_url}: {e}")
+        return []
+
+    # Find the total number of listings for the current price range
+    try:
+        total_listings = scraper.parser.listing_count(doc)
+    except AttributeError:
+        print(f"Could not find listing count for {price_range}, assuming no listings.")
+        total_listings = 0
+
+    # Keep splitting (both halves at once) while the band holds more listings than the pages can show
+    halves = split_price_band(min_price, max_price)
+    if total_listings > MAX_PAGES * RESULTS_PER_PAGE and halves:
+        parts = await asyncio.gather(*[partition_price_band_async(scraper, baseurl, *half) for half in halves])
+        return [band for part in parts for band in part]
+
+    print(f"Found {total_listings} listings for price range {price_range}")
+    return [(price_range, total_listings, scraper.parser.listing_links(doc, baseurl) or [])]
+
+
+
+async def generate_url_list_async(baseurl, scraper=None, **scraper_kwargs):
+    '''
+    Generates a list of VIC property urls, fetching the pages for every price range
+    concurrently over a single pooled session. Price bands are split until each fits under 
+    the page cap, and only the pages that exist for each band are fetched. Any extra 
+    keyword arguments are passed to AsyncScraper when no scraper is given
+    '''
+
+    if scraper is None:
+        async with AsyncScraper(**scraper_kwargs) as scraper:
+            return await generate_url_list_async(baseurl, scraper)
+
+    print("\nGenerating the list of links...\n")
+
+    # Partition every starting price band at once
+    parts = await asyncio.gather(*[partition_price_band_async(scraper, baseurl, *band) for band in price_bands()])
+    bands = [band for part in parts for band in part]
+
+    # Page 1 was already fetched with the count, so only the remaining pages are needed
+    url_links = []
+    jobs = []
+    for price_range, total_listings, first_page_links in bands:
+        url_links.extend(first_page_links)
+        jobs.extend(fetch_links_for_price_range_async(scraper, baseurl, price_range, page)
+                    for page in range(2, num_result_pages(total_listings) + 1))
+
+    for job in tqdm(asyncio.as_completed(jobs), total=len(jobs)):
+        url_links.extend(await job)
+
+    url_links = list(set(url_links))  # Remove duplicates
+    return url_links
+
+
+
+def generate_url_list(baseurl, **scraper_kwargs):
+    '''
+    Synchronous wrapper around generate_url_list_async
+    '''
+
+    return run_sync(generate_url_list_async(baseurl, **scraper_kwargs))
+
+
+######################### FUNCTIONS TO FETCH ALL THE DATA FOR EACH RENTAL #########################
+
+async def fetch_rental_data_async(scraper, property_url, property_metadata, journal=None):
+    '''
+    Fetches the rental data of interest for a particular property, recording the result
+    in the crawl journal if one is given
+    '''
+
+    try:
+        _, html, headers = await scraper.fetch_page(property_url)
+
+        # Compressing and writing the page is blocking, so do it off the event loop
+        if scraper.cache:
+            await asyncio.get_running_loop().run_in_executor(None, scraper.cache.put, property_url, html)
+
+        scraper.parser.rental_data(scraper.parser.parse(html), property_metadata[property_url])
+
+        if journal:
+            journal.mark_done(property_url, property_metadata[property_url], page_validators(html, headers))
+
+    except Exception as e:
+        print(f"Issue with {property_url}: {e}")
+        if journal:
+            journal.mark_failed(property_url, e, property_metadata.get(property_url))
+
+
+
+async def fetch_all_rental_data_async(url_links, scraper=None, journal=None, **scraper_kwargs):
+    '''
+    Fetches all the data for rentals in VIC concurrently over a single pooled session. If a
+    CrawlJournal is given, each property is saved to it as it arrives and urls already done
+    are skipped. Any extra keyword arguments are passed to AsyncScraper when no scraper is given
+    '''
+
+    if scraper is None:
+        async with AsyncScraper(**scraper_kwargs) as scraper:
+            return await fetch_all_rental_data_async(url_links, scraper, journal)
+
+    property_metadata = defaultdict(dict) # Initialise a dictionary
+
+    # Only fetch the urls the journal hasn't finished yet
+    todo_links = url_links
+    if journal:
+        journal.add_urls(url_links)
+        todo_links = journal.todo_urls(url_links)
+        print(f"{len(url_links) - len(todo_links)} properties already scraped, {len(todo_links)} to go")
+
+    jobs = [fetch_rental_data_async(scraper, url, property_metadata, journal) for url in todo_links]
+
+    # Display a progress bar as tasks complete
+    for job in tqdm(asyncio.as_completed(jobs), total=len(jobs)):
+        await job
+
+    # The journal also holds the properties scraped in earlier runs
+    if journal:
+        property_metadata = defaultdict(dict, journal.records(url_links))
+
+    return property_metadata # Return all the data
+
+
+
+def fetch_all_rental_data(url_links, journal=None, **scraper_kwargs):
+    '''
+    Synchronous wrapper around fetch_all_rental_data_async
+    '''
+
+    return run_sync(fetch_all_rental_data_async(url_links, journal=journal, **scraper_kwargs))
+
+
+
+############################# FUNCTIONS FOR INCREMENTAL RE-CRAWLS #############################
+
+async def recheck_rental_data_async(scraper, property_url, journal):
+    '''
+    Re-requests a previously scraped property with conditional headers and only re-parses 
+    it if the page has changed. Returns True if the stored record was updated
+    '''
+
+    validators = journal.validators(property_url)
+    headers = {}
+    if validators['etag']:
+        headers['If-None-Match'] = validators['etag']
+    if validators['last_modified']:
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    try:
+        status, html, response_headers = await scraper.fetch_page(property_url, headers)
+
+        # Not modified, or the server ignored the headers but the html is identical
+        new_validators = page_validators(html, response_headers)
+        if status == 304 or new_validators['content_hash'] == validators['content_hash']:
+            return False
+
+        if scraper.cache:
+            await asyncio.get_running_loop().run_in_executor(None, scraper.cache.put, property_url, html)
+
+        record = scraper.parser.rental_data(scraper.parser.parse(html))
+        journal.mark_done(property_url, record, new_validators)
+        return True
+
+    except Exception as e:
+        # Keep the previous record if the re-check fails
+        print(f"Issue re-checking {property_url}: {e}")
+        return False
+
+
+
+async def refresh_rental_data_async(url_links, journal, recheck=False, scraper=None, **scraper_kwargs):
+    '''
+    Incremental version of fetch_all_rental_data_async for daily refreshes. Compares the 
+    freshly discovered url_links with the urls already scraped in the journal and only 
+    fetches the new ones (plus any that failed before), carrying the previous records forward 
+    for the rest. With recheck=True the previously scraped urls are also re-requested with 
+    ETag/Last-Modified headers and re-parsed only if their page has changed. Returns the 
+    records for all of url_links
+    '''
+
+    if scraper is None:
+        async with AsyncScraper(**scraper_kwargs) as scraper:
+            return await refresh_rental_data_async(url_links, journal, recheck, scraper)
+
+    # Diff the new url list against the previous snapshot
+    previous_links = set(journal.done_urls())
+    current_links = set(url_links)
+    kept_links = [url for url in url_links if url in previous_links]
+    print(f"{len(current_links - previous_links)} new listings, {len(kept_links)} previously scraped, "
+          f"{len(previous_links - current_links)} no longer listed")
+
+    # Fetch the new urls (the journal skips the ones already done)
+    await fetch_all_rental_data_async(url_links, scraper, journal)
+
+    # Optionally check whether the previously scraped listings have changed
+    if recheck and kept_links:
+        jobs = [recheck_rental_data_async(scraper, url, journal) for url in kept_links]
+        num_changed = 0
+        for job in tqdm(asyncio.as_completed(jobs), total=len(jobs)):
+            num_changed += await job
+        print(f"{num_changed} of {len(kept_links)} previously scraped listings had changed")
+
+    return defaultdict(dict, journal.records(url_links))
+
+
+
+def refresh_rental_data(url_links, journal, recheck=False, **scraper_kwargs):
+    '''
+    Synchronous wrapper around refresh_rental_data_async
+    '''
+
+    return run_sync(refresh_rental_data_async(url_links, journal, recheck, **scraper_kwargs))
@@ -0,0 +1,193 @@
+## Python script with a SQLite crawl journal so the domain.com scrape can be stopped and resumed ##
+## without losing the properties already scraped ##
+
+import os
+import json
+import hashlib
+import time
+import sqlite3
+import threading
+
+
+JOURNAL_PATH = "../data/landing/domain/crawl_journal.sqlite"
+VALIDATOR_COLUMNS = ['etag', 'last_modified', 'content_hash']
+
+
+
+def page_validators(html, headers):
+    '''
+    Returns the ETag and Last-Modified headers of a fetched page along with a hash of its
+    html, used to tell whether the page has changed since it was last scraped
+    '''
+
+    # Header names are case-insensitive (and lowercase over HTTP/2)
+    headers = {name.lower(): value for name, value in headers.items()}
+
+    return {
+        'etag': headers.get('etag'),
+        'last_modified': headers.get('last-modified'),
+        'content_hash': hashlib.sha1(html.encode('utf-8')).hexdigest()
+    }
+
+
+
+class CrawlJournal:
+    '''
+    Keeps track of every property url as 'pending', 'done' or 'failed' and stores each
+    scraped property record as soon as it arrives. Each write is committed straight away, so
+    a crash only loses the pages that were in flight. Safe to share between threads
+    '''
+
+    def __init__(self, path=JOURNAL_PATH):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+        # WAL lets each commit be a cheap append instead of a full rewrite
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT
+            )""")
+        # Add the page validator columns to journals made before incremental crawls existed
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(urls)")]
+        for column in VALIDATOR_COLUMNS:
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE urls ADD COLUMN {column} TEXT")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS properties (
+                url TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                fetched_at REAL
+            )""")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add_urls(self, urls):
+        '''
+        Adds any urls not already in the journal as pending
+        '''
+
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO urls (url, updated_at) VALUES (?, ?)",
+                                  [(url, time.time()) for url in urls])
+            self.conn.commit()
+
+    def todo_urls(self, urls=None):
+        '''
+        Returns the urls that still need fetching (pending or failed), limited to the given
+        urls if any are given
+        '''
+
+        with self.lock:
+            rows = self.conn.execute("SELECT url FROM urls WHERE status != 'done'").fetchall()
+
+        todo = [row[0] for row in rows]
+        if urls is not None:
+            wanted = set(urls)
+            todo = [url for url in todo if url in wanted]
+        return todo
+
+    def done_urls(self):
+        '''
+        Returns every url that has been scraped successfully
+        '''
+
+        with self.lock:
+            rows = self.conn.execute("SELECT url FROM urls WHERE status = 'done'").fetchall()
+        return [row[0] for row in rows]
+
+    def validators(self, url):
+        '''
+        Returns the stored ETag, Last-Modified and content hash for the url
+        '''
+
+        with self.lock:
+            row = self.conn.execute("SELECT etag, last_modified, content_hash FROM urls WHERE url = ?",
+                                    (url,)).fetchone()
+        return dict(zip(VALIDATOR_COLUMNS, row or [None] * len(VALIDATOR_COLUMNS)))
+
+    def mark_done(self, url, record, validators=None):
+        '''
+        Stores the scraped record (and page validators, if given) for the url and marks it
+        as done
+        '''
+
+        self._write(url, 'done', None, record, validators)
+
+    def mark_failed(self, url, error, record=None):
+        '''
+        Marks the url as failed with the given error, keeping whatever part of the record
+        was scraped before the failure
+        '''
+
+        self._write(url, 'failed', str(error), record)
+
+    def _write(self, url, status, error, record, validators=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO urls (url, status, attempts, error, updated_at) VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET status = excluded.status, attempts = attempts + 1,
+                                               error = excluded.error, updated_at = excluded.updated_at
+                """, (url, status, error, now))
+            if validators is not None:
+                self.conn.execute("UPDATE urls SET etag = ?, last_modified = ?, content_hash = ? WHERE url = ?",
+                                  [validators.get(column) for column in VALIDATOR_COLUMNS] + [url])
+            if record is not None:
+                self.conn.execute("INSERT OR REPLACE INTO properties (url, record, fetched_at) VALUES (?, ?, ?)",
+                                  (url, json.dumps(record), now))
+            self.conn.commit()
+
+    def records(self, urls=None):
+        '''
+        Returns a dictionary of url -> scraped record, limited to the given urls if any
+        are given
+        '''
+
+        with self.lock:
+            rows = self.conn.execute("SELECT url, record FROM properties").fetchall()
+
+        records = {url: json.loads(record) for url, record in rows}
+        if urls is not None:
+            records = {url: records[url] for url in urls if url in records}
+        return records
+
+    def status_counts(self):
+        '''
+        Returns how many urls are pending, done and failed
+        '''
+
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM urls GROUP BY status").fetchall()
+        return dict(rows)
+
+    def export_json(self, path, urls=None):
+        '''
+        Writes the scraped records to the given json file in the same format as
+        all_properties_metadata.json
+        '''
+
+        with open(path, 'w') as f:
+            json.dump(self.records(urls), f)
+        print(f"Saved {path}")
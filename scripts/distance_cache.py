@@ -0,0 +1,147 @@
+## Python script with a SQLite cache of driving distances, so each origin/destination pair is ##
+## only routed once, however many listings, years or notebook runs share it ##
+
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+
+
+DISTANCE_CACHE_PATH = "../data/raw/driving_distances.sqlite"
+DEFAULT_PRECISION = 5  # decimal places of latitude/longitude, 5 places is about 1m
+KEY_COLUMNS = ['profile', 'origin_lat', 'origin_lon', 'dest_lat', 'dest_lon']
+
+
+
+class DistanceCache:
+    '''
+    Stores the driving distance (in km) between pairs of coordinates for each routing
+    profile. Coordinates are snapped to 'precision' decimal places, so listings at the same
+    spot share one entry. Pairs that couldn't be routed are stored as NULL, so they aren't
+    asked for again either. Safe to share between threads
+    '''
+
+    def __init__(self, path=DISTANCE_CACHE_PATH, precision=DEFAULT_PRECISION):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self.path = path
+        self.precision = precision
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+        # WAL lets each commit be a cheap append instead of a full rewrite
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS distances (
+                profile TEXT NOT NULL,
+                origin_lat REAL NOT NULL,
+                origin_lon REAL NOT NULL,
+                dest_lat REAL NOT NULL,
+                dest_lon REAL NOT NULL,
+                distance_km REAL,
+                fetched_at REAL,
+                PRIMARY KEY (profile, origin_lat, origin_lon, dest_lat, dest_lon)
+            ) WITHOUT ROWID""")
+        # Scratch table for looking up many pairs with one join
+        self.conn.execute("""
+            CREATE TEMP TABLE wanted (
+                position INTEGER PRIMARY KEY,
+                profile TEXT,
+                origin_lat REAL,
+                origin_lon REAL,
+                dest_lat REAL,
+                dest_lon REAL
+            )""")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def keys(self, origin_lats, origin_lons, dest_lats, dest_lons, profile):
+        '''
+        Returns the cache key of each pair: the profile and the snapped coordinates
+        '''
+
+        coords = np.column_stack([np.round(np.asarray(values, dtype=float), self.precision)
+                                  for values in (origin_lats, origin_lons, dest_lats, dest_lons)])
+        return [(profile, *row) for row in coords.tolist()]
+
+    def lookup(self, origin_lats, origin_lons, dest_lats, dest_lons, profile='driving-car'):
+        '''
+        Returns a boolean array marking which pairs are in the cache, and an array of their
+        distances in km (NaN for pairs that aren't cached or couldn't be routed)
+        '''
+
+        keys = self.keys(origin_lats, origin_lons, dest_lats, dest_lons, profile)
+
+        with self.lock:
+            self.conn.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(position, *key) for position, key in enumerate(keys)])
+            rows = self.conn.execute(f"""
+                SELECT wanted.position, distances.distance_km
+                FROM wanted JOIN distances USING ({', '.join(KEY_COLUMNS)})""").fetchall()
+            self.conn.execute("DELETE FROM wanted")
+            self.conn.commit()
+
+        found = np.zeros(len(keys), dtype=bool)
+        distances = np.full(len(keys), np.nan)
+        if rows:
+            positions, values = zip(*rows)
+            found[list(positions)] = True
+            distances[list(positions)] = np.array(values, dtype=float)  # None becomes NaN
+        return found, distances
+
+    def store(self, origin_lats, origin_lons, dest_lats, dest_lons, distances, profile='driving-car'):
+        '''
+        Saves the distances (in km, None or NaN for pairs that couldn't be routed) of the
+        given pairs
+        '''
+
+        keys = self.keys(origin_lats, origin_lons, dest_lats, dest_lons, profile)
+        now = time.time()
+
+        # Pairs with missing coordinates can never be looked up, so aren't worth keeping
+        rows = [key + (None if distance is None or distance != distance else float(distance), now)
+                for key, distance in zip(keys, distances)
+                if all(np.isfinite(key[1:]))]
+
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def count(self, profile=None):
+        '''
+        Returns the number of cached pairs, for the given profile or all of them
+        '''
+
+        with self.lock:
+            if profile is None:
+                return self.conn.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+            return self.conn.execute("SELECT COUNT(*) FROM distances WHERE profile = ?", (profile,)).fetchone()[0]
+
+
+
+DISTANCE_CACHES = {}
+DISTANCE_CACHES_LOCK = threading.Lock()
+
+
+
+def get_distance_cache(path=DISTANCE_CACHE_PATH, precision=DEFAULT_PRECISION):
+    '''
+    Returns the DistanceCache stored at path, shared by every caller in this process
+    '''
+
+    with DISTANCE_CACHES_LOCK:
+        if path not in DISTANCE_CACHES:
+            DISTANCE_CACHES[path] = DistanceCache(path, precision)
+        return DISTANCE_CACHES[path]
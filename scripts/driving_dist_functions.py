@@ -1,10 +1,11 @@
 ## Python script with functions to aid in fetching coordinates of different locations and calulating 
 ## their respective driving distaces to each property
 
+import numpy as np
 import pandas as pd
-from scipy.spatial import distance_matrix
-import time
-from openrouteservice import Client
+from scipy.spatial import cKDTree
+from scripts.distance_cache import get_distance_cache
+from scripts.routing import to_unit_vectors, chords_to_km, get_routing_backend
 
 
 def get_cities(api, query):
@@ -98,192 +99,181 @@ def fetch_amenities(api, node_query, way_query):
 
 
 
-def calculate_closest_amenity(property_df, amenity_df):
+class AmenityIndex:
     '''
-    Uses Euclidean distance to compare and find the closest amenity to each 
-    given property and amenity dataframes and adds them to the property_df
+    Nearest neighbour index over the locations of one type of amenity. The amenities are
+    placed on the unit sphere in a KD-tree, so each property's nearest amenities are found
+    in O(log M) time without a property x amenity distance matrix. Build it once per amenity
+    type and reuse it for every property dataframe
     '''
 
-    # Creates a copy of each dataframe to remove warning
+    def __init__(self, amenity_df, lat_col='lat', lon_col='lon'):
+        lats = amenity_df[lat_col].astype(float).to_numpy()
+        lons = amenity_df[lon_col].astype(float).to_numpy()
+
+        # Amenities without a location can't be anyone's nearest
+        valid = np.isfinite(lats) & np.isfinite(lons)
+        self.lats = lats[valid]
+        self.lons = lons[valid]
+        self.tree = cKDTree(to_unit_vectors(self.lats, self.lons))
+
+    def query(self, lats, lons, k=1):
+        '''
+        Returns the great-circle distances (in km) to the k nearest amenities of each coordinate,
+        nearest first, and their positions in self.lats and self.lons. Both are arrays of shape
+        (coordinates x k), with NaN and -1 for coordinates that are missing
+        '''
+
+        points = to_unit_vectors(lats, lons)
+        valid = np.isfinite(points).all(axis=1)
+        k = min(k, len(self.lats))
+
+        distances = np.full((len(points), k), np.nan)
+        indices = np.full((len(points), k), -1, dtype=np.int64)
+        chords, found = self.tree.query(points[valid], k=k)
+
+        distances[valid] = chords_to_km(chords).reshape(-1, k)
+        indices[valid] = found.reshape(-1, k)
+        return distances, indices
+
+
+
+def build_amenity_indexes(amenity_dfs):
+    '''
+    Builds an AmenityIndex for each amenity type in the given dictionary of dataframes
+    '''
+
+    return {amenity_type: AmenityIndex(amenity_df) for amenity_type, amenity_df in amenity_dfs.items()}
+
+
+
+def calculate_closest_amenity(property_df, amenity_df, k=1):
+    '''
+    Uses great-circle distance to find the closest amenity to each property and
+    adds its 'amenity_lat', 'amenity_lon' and 'amenity_dist' (in km) to a copy of
+    property_df. amenity_df is a dataframe with 'lat' and 'lon' columns, or an
+    AmenityIndex built from one. With k > 1 the k closest amenities are added,
+    nearest first, as 'amenity_lat_1', 'amenity_lon_1', 'amenity_dist_1', ...
+    '''
+
+    # Creates a copy of the dataframe to remove warning
     pdf = property_df.copy()
-    adf = amenity_df.copy()
+    index = amenity_df if isinstance(amenity_df, AmenityIndex) else AmenityIndex(amenity_df)
     
     # Ensure that the latitude and longitude are converted to floats
     pdf['latitude'] = pdf['latitude'].astype(float)
     pdf['longitude'] = pdf['longitude'].astype(float)
-    adf['lat'] = adf['lat'].astype(float)
-    adf['lon'] = adf['lon'].astype(float)
 
-    # Extract lat/lon as numpy arrays
-    property_coords = pdf[['latitude', 'longitude']].to_numpy()
-    amenity_coords = adf[['lat', 'lon']].to_numpy()
-    
-    # Calculate distance matrix between all properties and the amenity
-    dist_matrix = distance_matrix(property_coords, amenity_coords)
+    # Find the k nearest amenities of every property
+    distances, indices = index.query(pdf['latitude'], pdf['longitude'], k)
     
-    # Find the index of the minimum distance (closest amenity) for each property
-    closest_amenity_indices = dist_matrix.argmin(axis=1)
-    
-    # Add closest amenity name, latitude, and longitude to pdf
-    pdf['amenity_lat'] = adf.iloc[closest_amenity_indices]['lat'].values
-    pdf['amenity_lon'] = adf.iloc[closest_amenity_indices]['lon'].values
+    # Add the closest amenities' latitude, longitude and distance to pdf
+    for j in range(distances.shape[1]):
+        suffix = '' if k == 1 else f'_{j + 1}'
+        found = indices[:, j] >= 0
+        pdf[f'amenity_lat{suffix}'] = np.where(found, index.lats[indices[:, j]], np.nan)
+        pdf[f'amenity_lon{suffix}'] = np.where(found, index.lons[indices[:, j]], np.nan)
+        pdf[f'amenity_dist{suffix}'] = distances[:, j]
 
     return pdf
 
 
 
-def get_batch_distances(df, api_keys, p_lat, p_lon, a_lat, a_lon, batch_size=50):
+def get_batch_distances(df, router, p_lat, p_lon, a_lat, a_lon, cache=None):
     '''
-    Makes batch api calls to Open Route Services to calculate the driving distance between
-    each property and amenity pair given, and returns the distances of each pair
+    Returns the driving distance (in km, None where it couldn't be found) between each
+    property and amenity pair given. router is a routing backend, its name, or a list of
+    ORS api keys (see get_routing_backend). Each distinct pair is only routed once: pairs
+    already in the distance cache (the shared one by default) are read from it, and only
+    the rest are routed
     '''
 
-    # Initialising the return list and api key index
-    all_distances = []
-    current_key = 0
+    backend = get_routing_backend(router)
+    cache = cache or get_distance_cache()
 
-    # Setting the client to make api calls with the given api key
-    client = Client(key=api_keys[current_key])
-    
-    # Loops through the dataframe in the size of one batch at a time
-    for i in range(0, len(df), batch_size):
-        batch = df.iloc[i:i + batch_size]
-        
-        # Prepare coordinates: first half are properties, second half are stations
-        coords = [[row[p_lon], row[p_lat]] for _, row in batch.iterrows()] + \
-                 [[row[a_lon], row[a_lat]] for _, row in batch.iterrows()]
-        
-        # Error handling variables
-        retries = 0  # Track retries for a batch
-        max_retries = 3  # Limit retries to avoid infinite loops
-
-        while retries < max_retries:
-            try:
-                # ORS Matrix API request for driving distances
-                matrix = client.distance_matrix(
-                    locations=coords, 
-                    profile='driving-car',
-                    metrics=['distance'],
-                    sources=list(range(len(batch))),  # Property indices
-                    destinations=list(range(len(batch), len(batch)*2))  # Amenity indices
-                )
-                
-                # Get driving distances and append
-                for j in range(len(batch)):
-                    distance = matrix['distances'][j][j]  # Property to amenity distance
-
-                    if isinstance(distance, (int, float)):
-                        all_distances.append(distance / 1000)  # Convert from meters to kilometers
-                    else:
-                        all_distances.append(None)
-                break # Successfully completed this batch, move to next batch
-
-            except Exception as e:
-                print(f"Error with batch {(i/batch_size)+1}: {e}")
-
-                # Handle error in calculation
-                if 'unsupported operand type' in str(e):
-                    print("Cannot complete batch request on this set of properties. Skipping to next batch.\n")
-                    retries=max_retries
-                # Handle daily limit exceeded
-                elif "403" in str(e) and "Quota exceeded" in str(e):
-                    print(f"Quota limit exceeded for API key {api_keys[current_key]}")
-                    current_key += 1  # Switch to the next API key
-
-                    if current_key >= len(api_keys):
-                        print("All API keys exhausted. Stopping the API calls...\n")
-                        all_distances.extend([None] * len(batch))  # Append None for failed requests
-                        return all_distances  # Exit if all keys are exhausted
-                    
-                    # Set new API key and wait before retrying
-                    client = Client(key=api_keys[current_key])
-                    print("Using a new key...\nWaiting for 5 seconds before continuing.")
-                    time.sleep(5)
-                    retries += 1  # Increment retries counter
-
-                # Handle rate limit exceeded
-                elif "403" in str(e):
-                    print("Rate limit exceeded. Waiting for 60 seconds...")
-                    time.sleep(60)  # Wait for a minute before retrying
-                    retries += 1  # Increment retries counter
-
-                # Handle other errors (e.g., HTTP 502)
-                else:
-                    print(f"Unexpected error occurred: {e}.\nRetrying after 3 seconds...")
-                    time.sleep(3)  # Wait before retrying
-                    retries += 1  # Increment retries counter
-
-        # If retries exceeded max_retries, append None for this batch
-        if retries>=max_retries:
-            print(f"Maximum retries reached for batch {(i/batch_size)+1}, skipping to next batch...\n")
-            all_distances.extend([None] * len(batch))
-
-        # Respect the rate limit by adding a delay between batches
-        time.sleep(2)  
-    
-    return all_distances
+    # Snap the coordinates the same way as the cache, and number each distinct pair so rows
+    # sharing a pair (duplicate listings, the same property in different years) share a code
+    pairs = df[[p_lat, p_lon, a_lat, a_lon]].astype(float).round(cache.precision)
+    codes = pairs.groupby([p_lat, p_lon, a_lat, a_lon], sort=False, dropna=False).ngroup().to_numpy()
+    unique_pairs = pairs.iloc[np.unique(codes, return_index=True)[1]]
+    print(f"{len(unique_pairs)} distinct pairs in {len(df)} rows")
+
+    # Look up every pair in the cache before routing any of them
+    found, distances = cache.lookup(unique_pairs[p_lat], unique_pairs[p_lon], unique_pairs[a_lat], unique_pairs[a_lon],
+                                    backend.profile)
+    print(f"{found.sum()} of {len(unique_pairs)} distances found in the cache")
+
+    # Pairs with a missing coordinate can't be routed, so don't request them either
+    found |= unique_pairs.isna().any(axis=1).to_numpy()
+
+    if not found.all():
+        distances[~found] = backend.distances(unique_pairs[~found], p_lat, p_lon, a_lat, a_lon, cache)
+
+    # Broadcast the distance of each distinct pair back onto all of its rows
+    return [None if np.isnan(distance) else distance for distance in distances[codes]]
 
 
 
-def get_dist_to_city(property_df, cities_df, api_keys):
+def get_dist_to_city(property_df, cities_df, router):
     '''
-    Sets and runs the pipeline to find the closest city for each property and uses ORS to find the 
-    driving distance. Returns the dataframe with the distances to the closest city
+    Sets and runs the pipeline to find the closest city for each property and uses the router (see
+    get_batch_distances) to find the driving distance. Returns the dataframe with the distances to
+    the closest city
     '''
  
-    # Step 1: Calculate the closest city using Euclidean distance
+    # Step 1: Calculate the closest city using great-circle distance
     property_df = calculate_closest_amenity(property_df, cities_df)
 
-    # Step 2: Make batch ORS API calls to get driving distances
+    # Step 2: Route the driving distances
     distances = get_batch_distances(
         property_df, 
-        api_keys, 
+        router, 
         p_lat='latitude', 
         p_lon='longitude', 
         a_lat='amenity_lat', 
-        a_lon='amenity_lon', 
-        batch_size=50
+        a_lon='amenity_lon'
     )
 
     # Step 3: Add the driving distance to the DataFrame with the correct column name
     property_df["dist_to_city"] = distances
 
     # Step 4: Remove the unneded columns
-    property_df = property_df.drop(["amenity_lat", "amenity_lon"], axis=1)
+    property_df = property_df.drop(["amenity_lat", "amenity_lon", "amenity_dist"], axis=1)
 
     return property_df
 
 
 
-def get_amenity_distances(property_df, amenity_dfs, api_keys):
+def get_amenity_distances(property_df, amenity_dfs, router):
     '''
-    Sets and runs the pipeline to find the closest amenity for each property and uses ORS to find the 
-    driving distance. Returns the dataframe with the distances to the closest amenity
+    Sets and runs the pipeline to find the closest amenity for each property and uses the router (see
+    get_batch_distances) to find the driving distance. Returns the dataframe with the distances to
+    the closest amenity. amenity_dfs can hold dataframes or the AmenityIndex of each amenity type
+    (see build_amenity_indexes)
     '''
 
     # Loop through each amenity type and compute the driving distance
     for amenity_type, amenity_df in amenity_dfs.items():
         print(f"Processing {amenity_type}...")
         
-        # Step 1: Calculate the closest amenity using Euclidean distance
+        # Step 1: Calculate the closest amenity using great-circle distance
         property_df = calculate_closest_amenity(property_df, amenity_df)
         
-        # Step 2: Make batch ORS API calls to get driving distances
+        # Step 2: Route the driving distances
         distances = get_batch_distances(
             property_df, 
-            api_keys, 
+            router, 
             p_lat='latitude', 
             p_lon='longitude', 
             a_lat='amenity_lat', 
-            a_lon='amenity_lon', 
-            batch_size=50
+            a_lon='amenity_lon'
         )
         
         # Step 3: Add the driving distance to the DataFrame with the correct column name
         property_df[f"dist_to_{amenity_type}"] = distances
 
         # Step 4: Remove the unneded columns
-        property_df = property_df.drop(["amenity_lat", "amenity_lon"], axis=1)
+        property_df = property_df.drop(["amenity_lat", "amenity_lon", "amenity_dist"], axis=1)
     
     return property_df
 
@@ -0,0 +1,195 @@
+## Python script with the models used to extrapolate the yearly SA2 datasets. Every model fits ##
+## all the rows of a table at once and shares the same fit/predict interface ##
+
+import numpy as np
+
+
+DEFAULT_EXTRAPOLATOR = "linear"
+
+
+############################################ LEAST SQUARES ############################################
+
+class LeastSquaresExtrapolator:
+    '''
+    Base for the models that are a least squares fit on a design matrix of the years. The
+    design matrix is shared by every row, so all rows are solved together in one call
+    '''
+
+    name = None
+    coefficient_names = []
+
+    def design(self, years):
+        '''
+        Returns the design matrix for the given years, one column per coefficient
+        '''
+
+        raise NotImplementedError
+
+    def transform(self, values):
+        return values
+
+    def inverse_transform(self, values):
+        return values
+
+    def fit(self, years, values):
+        '''
+        Fits every row of 'values' (an array of regions x years) over the given years
+        '''
+
+        years = np.asarray(years, dtype=float)
+        self.years = years
+        self.coefficients, _, _, _ = np.linalg.lstsq(self.design(years), self.transform(np.asarray(values, dtype=float)).T,
+                                                     rcond=None)
+        return self
+
+    def predict(self, years):
+        '''
+        Returns the predicted values of every row for the given years (an array of regions x years)
+        '''
+
+        years = np.asarray(years, dtype=float)
+        return self.inverse_transform((self.design(years) @ self.coefficients).T)
+
+    def params(self):
+        '''
+        Returns a dictionary of coefficient name -> array with the coefficient of each row
+        '''
+
+        return dict(zip(self.coefficient_names, self.coefficients))
+
+    def diagnostics(self, values):
+        '''
+        Returns the root mean squared error and R^2 of each row's fit over the years it was
+        fitted on
+        '''
+
+        values = np.asarray(values, dtype=float)
+        residuals = values - self.predict(self.years)
+
+        ss_res = (residuals ** 2).sum(axis=1)
+        ss_tot = ((values - values.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+
+        return {'rmse': np.sqrt(ss_res / values.shape[1]), 'r2': r2}
+
+
+
+class LinearExtrapolator(LeastSquaresExtrapolator):
+    '''
+    Straight line through each row's values (the same fit as statsmodels OLS with a constant)
+    '''
+
+    name = "linear"
+    coefficient_names = ['intercept', 'slope']
+
+    def design(self, years):
+        return np.column_stack([np.ones(len(years)), years])
+
+
+
+class LogLinearExtrapolator(LinearExtrapolator):
+    '''
+    Straight line through log(1 + value), so each row grows or shrinks by a constant
+    percentage a year and never goes below zero. Suits counts like population and businesses
+    '''
+
+    name = "log_linear"
+    coefficient_names = ['log_intercept', 'log_slope']
+
+    def transform(self, values):
+        return np.log1p(np.clip(values, 0, None))
+
+    def inverse_transform(self, values):
+        return np.expm1(values)
+
+
+
+class DampedTrendExtrapolator(LinearExtrapolator):
+    '''
+    Linear fit inside the observed years, with the slope shrinking by a factor of 'damping'
+    for every year beyond them, so long range forecasts level off instead of running away
+    '''
+
+    name = "damped"
+
+    def __init__(self, damping=0.8):
+        self.damping = damping
+
+    def predict(self, years):
+        years = np.asarray(years, dtype=float)
+        first, last = self.years.min(), self.years.max()
+        intercept, slope = self.coefficients
+
+        # Years past either end of the data get the value at that end plus a damped trend
+        # (the sum of damping^1 ... damping^h over the h years beyond it)
+        clipped = np.clip(years, first, last)
+        beyond = np.abs(years - clipped)
+        if self.damping == 1:
+            damped_steps = beyond
+        else:
+            damped_steps = self.damping * (1 - self.damping ** beyond) / (1 - self.damping)
+        direction = np.sign(years - clipped)
+
+        return (intercept[:, None] + slope[:, None] * clipped[None, :]
+                + slope[:, None] * (direction * damped_steps)[None, :])
+
+
+
+class SplineExtrapolator(LeastSquaresExtrapolator):
+    '''
+    Piecewise linear fit (a linear spline) with the slope allowed to change at each knot, so
+    recent years set the trend that is extrapolated. The knot defaults to the middle observed
+    year. Knots the observed years can't pin down (e.g. with fewer than 3 distinct years) are
+    dropped, leaving a straight line fit
+    '''
+
+    name = "spline"
+
+    def __init__(self, knots=None):
+        self.knots = knots
+
+    def fit(self, years, values):
+        years = np.asarray(years, dtype=float)
+        self.fitted_knots = self.knots
+        if self.fitted_knots is None:
+            self.fitted_knots = [float(np.median(years))]
+
+        # A knot without enough observed years around it gives a zero or collinear hinge column,
+        # and lstsq would quietly return a minimum norm fit, so fall back to a straight line
+        if np.linalg.matrix_rank(self.design(years)) < 2 + len(self.fitted_knots):
+            print(f"Can't fit spline knots {list(self.fitted_knots)} on {len(np.unique(years))} distinct years, "
+                  f"fitting a straight line instead")
+            self.fitted_knots = []
+
+        self.coefficient_names = ['intercept', 'slope'] + [f'slope_change_{knot:g}' for knot in self.fitted_knots]
+        return super().fit(years, values)
+
+    def design(self, years):
+        hinges = [np.maximum(0, years - knot) for knot in self.fitted_knots]
+        return np.column_stack([np.ones(len(years)), years] + hinges)
+
+
+
+############################################ REGISTRY ############################################
+
+EXTRAPOLATORS = {
+    LinearExtrapolator.name: LinearExtrapolator,
+    LogLinearExtrapolator.name: LogLinearExtrapolator,
+    DampedTrendExtrapolator.name: DampedTrendExtrapolator,
+    SplineExtrapolator.name: SplineExtrapolator
+}
+
+
+
+def get_extrapolator(extrapolator=None, **params):
+    '''
+    Returns a new extrapolator given its name ('linear', 'log_linear', 'damped' or 'spline')
+    and any model parameters, or an existing extrapolator, defaulting to DEFAULT_EXTRAPOLATOR
+    '''
+
+    if extrapolator is None:
+        extrapolator = DEFAULT_EXTRAPOLATOR
+    if isinstance(extrapolator, str):
+        return EXTRAPOLATORS[extrapolator](**params)
+    return extrapolator
@@ -0,0 +1,144 @@
+## Python script with a cached, columnar store of the extrapolated SA2 datasets, so they are ##
+## parsed from csv once instead of on every call to add_data ##
+
+import os
+import glob
+import threading
+import pandas as pd
+
+
+EXTERNAL_DATA_DIR = '../data/curated/'
+STORE_NAME = 'external_features.parquet'
+TABLE_PATTERN = 'extrapolated_*.csv'
+
+
+
+def read_extrapolated_csv(csv_path, table_name, mtime):
+    '''
+    Reads one extrapolated_*.csv (a row per SA2 region, or per metric for the inflation
+    data, and a column per year) into the long form used by the store
+    '''
+
+    wide_df = pd.read_csv(csv_path, index_col=0)
+    wide_df.index.name = 'SA2_name_2021'
+
+    # Only keep the year columns
+    wide_df = wide_df[[col for col in wide_df.columns if str(col).isdigit()]]
+
+    long_df = wide_df.stack(dropna=False).rename('value').reset_index()
+    long_df.columns = ['SA2_name_2021', 'year', 'value']
+    long_df['year'] = long_df['year'].astype('int16')
+    long_df['value'] = long_df['value'].astype('float64')
+    long_df.insert(0, 'table', table_name)
+    long_df['source_mtime'] = mtime
+
+    return long_df
+
+
+
+class FeatureStore:
+    '''
+    Combines every extrapolated_*.csv in data_dir into one parquet file in long form, with
+    the table and SA2_name_2021 columns as categoricals, year as int16 and value as float64.
+    The file is only read when a table is first asked for, and each table is kept in memory
+    after that. Every lookup checks the modification time of the table's csv, and a table
+    whose csv has changed is re-read and rewritten to the store. Safe to share between
+    threads
+    '''
+
+    def __init__(self, data_dir=EXTERNAL_DATA_DIR, path=None):
+        self.data_dir = data_dir
+        self.path = path or os.path.join(data_dir, STORE_NAME)
+        self.long_df = None
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def csv_path(self, table_name):
+        return os.path.join(self.data_dir, f'{table_name}.csv')
+
+    def table_names(self):
+        '''
+        Returns the names of all the extrapolated tables in data_dir
+        '''
+
+        paths = sorted(glob.glob(os.path.join(self.data_dir, TABLE_PATTERN)))
+        return [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+    def table(self, table_name):
+        '''
+        Returns the table in the same layout as its csv: indexed by SA2 region (or metric)
+        with a string column for each year. The returned dataframe is shared, don't modify it
+        '''
+
+        mtime = os.path.getmtime(self.csv_path(table_name))
+
+        with self.lock:
+            cached = self.tables.get(table_name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+            long_df = self._long_table(table_name, mtime)
+
+            # Pivot back into one row per region and one column per year
+            wide_df = long_df.astype({'SA2_name_2021': str}).pivot(index='SA2_name_2021', columns='year', values='value')
+            wide_df.columns = wide_df.columns.astype(str)
+            wide_df.columns.name = None
+
+            self.tables[table_name] = (mtime, wide_df)
+            return wide_df
+
+    def load(self):
+        '''
+        Brings every table up to date and returns the whole store, indexed by SA2 region
+        and year
+        '''
+
+        for table_name in self.table_names():
+            self.table(table_name)
+
+        with self.lock:
+            return self.long_df.set_index(['SA2_name_2021', 'year']).sort_index()
+
+    def _long_table(self, table_name, mtime):
+        # Lazily read the store the first time any table is needed
+        if self.long_df is None:
+            self.long_df = pd.read_parquet(self.path) if os.path.exists(self.path) else None
+
+        if self.long_df is not None:
+            stored = self.long_df[self.long_df['table'] == table_name]
+            if len(stored) and (stored['source_mtime'] == mtime).all():
+                return stored
+
+        # Missing from the store or out of date, so rebuild the table from its csv
+        print(f"Updating {table_name} in the feature store")
+        fresh = read_extrapolated_csv(self.csv_path(table_name), table_name, mtime)
+
+        others = [] if self.long_df is None else [self.long_df[self.long_df['table'] != table_name]]
+        long_df = pd.concat(others + [fresh], ignore_index=True)
+        for col in ['table', 'SA2_name_2021']:
+            long_df[col] = long_df[col].astype(str).astype('category')
+        self.long_df = long_df
+
+        # Write to a temporary file first, so a crash never leaves a half written store
+        temp_path = f"{self.path}.tmp"
+        self.long_df.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self.path)
+
+        return self.long_df[self.long_df['table'] == table_name]
+
+
+
+FEATURE_STORES = {}
+FEATURE_STORES_LOCK = threading.Lock()
+
+
+
+def get_feature_store(data_dir=EXTERNAL_DATA_DIR):
+    '''
+    Returns the FeatureStore for data_dir, shared by every caller in this process
+    '''
+
+    with FEATURE_STORES_LOCK:
+        if data_dir not in FEATURE_STORES:
+            FEATURE_STORES[data_dir] = FeatureStore(data_dir)
+        return FEATURE_STORES[data_dir]
@@ -0,0 +1,91 @@
+## Python script with a local stand-in for domain.com that serves saved fixture pages, so the ##
+## scrapers can be run and benchmarked without touching the real website ##
+
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from scripts import parallelised_scrape, async_scrape
+
+
+FIXTURE_DIR = "../data/landing/domain/fixtures"
+DOMAIN_URL = "https://www.domain.com.au"
+
+
+
+def serve_fixtures(fixture_dir=FIXTURE_DIR, port=0, delay=0.0):
+    '''
+    Starts a threaded HTTP server in the background that answers every /rent/ search with
+    search.html and every other path with listing.html. Links to domain.com inside the pages
+    are rewritten to point back at this server. 'delay' adds a fixed wait (in seconds) to each
+    response to mimic network latency. Returns the server and its base url; call
+    server.shutdown() when finished
+    '''
+
+    # Read the fixture pages once up front
+    with open(os.path.join(fixture_dir, "search.html"), encoding="utf-8") as file:
+        search_html = file.read()
+    with open(os.path.join(fixture_dir, "listing.html"), encoding="utf-8") as file:
+        listing_html = file.read()
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+
+            # Search pages go to the results fixture, everything else is a property page
+            html = search_html if self.path.startswith("/rent/") else listing_html
+            body = html.replace(DOMAIN_URL, base_url).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep the notebook output clean
+            return
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    server.daemon_threads = True
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, base_url
+
+
+
+def fixture_urls(base_url, n):
+    '''
+    Returns n distinct property urls on the fixture server
+    '''
+
+    return [f"{base_url}/fixture-property-{i}" for i in range(n)]
+
+
+
+def benchmark_scrapers(n_urls=500, delay=0.05, fixture_dir=FIXTURE_DIR, **scraper_kwargs):
+    '''
+    Times the threaded and asyncio versions of fetch_all_rental_data against the fixture
+    server for n_urls property pages and returns the pages per second of each
+    '''
+
+    server, base_url = serve_fixtures(fixture_dir, delay=delay)
+    url_links = fixture_urls(base_url, n_urls)
+    results = {}
+
+    try:
+        for name, scraper in [("threads", parallelised_scrape.fetch_all_rental_data),
+                              ("asyncio", lambda urls: async_scrape.fetch_all_rental_data(urls, **scraper_kwargs))]:
+            start = time.perf_counter()
+            scraper(url_links)
+            elapsed = time.perf_counter() - start
+            results[name] = n_urls / elapsed
+            print(f"{name}: {n_urls} pages in {elapsed:.2f}s ({results[name]:.1f} pages/s)")
+    finally:
+        server.shutdown()
+
+    return results
@@ -0,0 +1,400 @@
+## Python script with the page parsers for domain.com, with a BeautifulSoup backend for ##
+## compatibility and a faster lxml backend that uses precompiled XPath selectors ##
+
+import os
+import re
+import time
+import numpy as np
+from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
+from urllib.parse import urlparse, parse_qs
+
+
+FIXTURE_DIR = "../data/landing/domain/fixtures"
+DEFAULT_PARSER = "lxml"
+
+
+########################################## BEAUTIFULSOUP ##########################################
+
+class SoupParser:
+    '''
+    Parses pages into a full BeautifulSoup tree and walks it with .find() calls. Slower, but 
+    matches the original scraper exactly
+    '''
+
+    name = "soup"
+
+    def parse(self, html):
+        '''
+        Parses the page html (text, bytes or a file-like response)
+        '''
+
+        return BeautifulSoup(html, "lxml")
+
+    def listing_links(self, bs_object, baseurl):
+        '''
+        Returns the property links found on a parsed search results page, or None if the 
+        page has no results list
+        '''
+
+        # Find the listings (ul element with specific data-testid attribute)
+        results = bs_object.find("ul", {"data-testid": "results"})
+        if not results:
+            return None
+
+        # Find all href (a) tags that are from the base_url website
+        index_links = results.findAll("a", href=re.compile(f"{baseurl}/*"))
+
+        # Filter for links with class 'address'
+        return [link['href'] for link in index_links if 'address' in link.get('class', [])]
+
+    def listing_count(self, bs_object):
+        '''
+        Returns the total number of listings shown on a parsed search results page
+        (raises AttributeError if the count can't be found)
+        '''
+
+        properties_div = bs_object.find("div", {"class": "css-9ny10o"})
+        properties_count_str = properties_div.find("h1", {"class": "css-ekkwk0"}).find("strong").text
+        return int(re.sub(r'[^\d]', '', properties_count_str))
+
+    def rental_data(self, bs_object, record=None):
+        '''
+        Scrapes the rental data of interest from a parsed property page into the given
+        record (a new dict if none is given) and returns it. Fields are filled in as they are
+        found, so a failure part way through leaves the earlier fields in place
+        '''
+
+        if record is None:
+            record = {}
+
+        # Scrape and store the property name
+        record['name'] = bs_object.find("h1", {"class": "css-164r41r"}).text
+
+        # Scrape and store the property cost
+        record['cost_text'] = bs_object.find("div", {"data-testid": "listing-details__summary-title"}).text
+
+        # Extract room and parking details using regex
+        rooms = bs_object.find("div", {"data-testid": "property-features"}).findAll("span", {"data-testid": "property-features-text-container"})
+        record['rooms'] = [
+            re.findall(r'\d+\s[A-Za-z]+', feature.text)[0] for feature in rooms if 'Bed' in feature.text or 'Bath' in feature.text
+        ]
+        record['parking'] = [
+            re.findall(r'\S+\s[A-Za-z]+', feature.text)[0] for feature in rooms if 'Parking' in feature.text
+        ]
+
+        # Scrape and store property description
+        record['desc'] = bs_object.find("p").get_text(separator='\n').strip()
+
+
+        # Scrape and store the property type (e.g., house, apartment)
+        record['property_type'] = bs_object.find(
+            "div", {"data-testid": "listing-summary-property-type"}).find("span", {"class": "css-in3yi3"}).text
+
+        # Extract additional details such as date available and bond using list items
+        ul_element = bs_object.find("div", {"data-testid": "strip-content-list"}).find("ul", {"data-testid": "listing-summary-strip"})
+        li_elements = ul_element.find_all("li")
+
+        date_available = np.nan
+        bond = np.nan
+
+        for li in li_elements:
+            strong_tag = li.find("strong")
+            if strong_tag:
+                text = strong_tag.get_text(strip=True)
+                li_text = li.get_text(strip=True)
+                if "Date Available:" in li_text:
+                    date_available = text
+                elif "Bond" in li_text:
+                    bond = text
+
+        # Store the date available and bond information
+        record['date_available'] = date_available
+        record['bond'] = bond
+
+        # Scrape additional property features if available
+        listing_details_div = bs_object.find("div", {"data-testid": "listing-details__additional-features"})
+        property_features = []
+        if listing_details_div:
+            expander_wrapper = listing_details_div.find("div", {"data-testid": "expander-wrapper"})
+            if expander_wrapper:
+                content_div = expander_wrapper.find("div", {"class": "noscript-expander-content css-1mnayj9"})
+                if content_div:
+                    ul_element = content_div.find("ul", {"class": "css-4ewd2m"})
+                    if ul_element:
+                        li_elements = ul_element.find_all("li", {"class": "css-vajaaq"})
+                        property_features = [li.get_text(strip=True) for li in li_elements]
+
+        record['property_features'] = property_features
+
+        # Scrape latitude and longitude for the property from the map link
+        map_div = bs_object.find("div", {"data-testid": "listing-details__map"}) \
+            .find("div", {"class": "css-yjd8ae"}) \
+            .find("div", {"class": "listing-details__location-map--default css-79elbk"}) \
+            .find("ul", {"class": "css-1vlxv67"}) \
+            .find_all("li", {"class": "css-1g3iwis"})[1] \
+            .find("a", {"class": "css-1aszeu9"})
+
+        latitude, longitude = None, None
+
+        # Extract coordinates from the map URL if available
+        if map_div and 'href' in map_div.attrs:
+            href = map_div['href']
+            destination = parse_qs(urlparse(href).query).get('destination', [None])[0]
+            if destination:
+                coordinates = destination.split(',')
+                if len(coordinates) == 2:
+                    latitude, longitude = coordinates
+
+        record['coordinates'] = [latitude, longitude]
+
+        return record
+
+
+############################################### LXML ###############################################
+
+def has_class(name):
+    '''
+    XPath condition matching elements whose class list contains the given class
+    '''
+
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+
+# Precompiled selectors, one per .find() step of the BeautifulSoup parser
+XPATHS = {key: etree.XPath(path) for key, path in {
+    'results': '//ul[@data-testid="results"]',
+    'result_links': './/a[@href]',
+    'count_div': f'//div[{has_class("css-9ny10o")}]',
+    'count_h1': f'.//h1[{has_class("css-ekkwk0")}]',
+    'strong': './/strong',
+    'name': f'//h1[{has_class("css-164r41r")}]',
+    'cost': '//div[@data-testid="listing-details__summary-title"]',
+    'features': '//div[@data-testid="property-features"]',
+    'feature_text': './/span[@data-testid="property-features-text-container"]',
+    'desc': '//p',
+    'type_div': '//div[@data-testid="listing-summary-property-type"]',
+    'type_span': f'.//span[{has_class("css-in3yi3")}]',
+    'strip_div': '//div[@data-testid="strip-content-list"]',
+    'strip_ul': './/ul[@data-testid="listing-summary-strip"]',
+    'li': './/li',
+    'extra_div': '//div[@data-testid="listing-details__additional-features"]',
+    'expander': './/div[@data-testid="expander-wrapper"]',
+    'expander_content': './/div[@class="noscript-expander-content css-1mnayj9"]',
+    'extra_ul': f'.//ul[{has_class("css-4ewd2m")}]',
+    'extra_li': f'.//li[{has_class("css-vajaaq")}]',
+    'map_div': '//div[@data-testid="listing-details__map"]',
+    'map_inner': f'.//div[{has_class("css-yjd8ae")}]',
+    'map_default': './/div[@class="listing-details__location-map--default css-79elbk"]',
+    'map_ul': f'.//ul[{has_class("css-1vlxv67")}]',
+    'map_li': f'.//li[{has_class("css-1g3iwis")}]',
+    'map_link': f'.//a[{has_class("css-1aszeu9")}]',
+}.items()}
+
+
+
+def find(node, key):
+    '''
+    Returns the first element matching the named selector under node, like BeautifulSoup's
+    .find(). Raises AttributeError if there is no match, as chaining .find() on None would
+    '''
+
+    if node is None:
+        raise AttributeError(f"no element to search for '{key}'")
+    matches = XPATHS[key](node)
+    if not matches:
+        raise AttributeError(f"'{key}' not found")
+    return matches[0]
+
+
+
+def find_optional(node, key):
+    '''
+    Returns the first element matching the named selector under node, or None
+    '''
+
+    matches = XPATHS[key](node)
+    return matches[0] if matches else None
+
+
+
+def text(node, separator='', strip=False):
+    '''
+    Returns the text of an element like BeautifulSoup's get_text()
+    '''
+
+    strings = node.itertext()
+    if strip:
+        strings = (string.strip() for string in strings if string.strip())
+    return separator.join(strings)
+
+
+
+class LxmlParser:
+    '''
+    Parses pages with lxml and looks up each field with precompiled XPath selectors, which 
+    is several times faster than building and walking a BeautifulSoup tree
+    '''
+
+    name = "lxml"
+
+    def parse(self, html):
+        '''
+        Parses the page html (text, bytes or a file-like response)
+        '''
+
+        if hasattr(html, 'read'):
+            html = html.read()
+        return lxml_html.fromstring(html)
+
+    def listing_links(self, doc, baseurl):
+        '''
+        Returns the property links found on a parsed search results page, or None if the 
+        page has no results list
+        '''
+
+        results = find_optional(doc, 'results')
+        if results is None:
+            return None
+
+        # Links from the base_url website with class 'address'
+        baseurl_pattern = re.compile(f"{baseurl}/*")
+        return [link.get('href') for link in XPATHS['result_links'](results)
+                if baseurl_pattern.search(link.get('href')) and 'address' in link.get('class', '').split()]
+
+    def listing_count(self, doc):
+        '''
+        Returns the total number of listings shown on a parsed search results page
+        (raises AttributeError if the count can't be found)
+        '''
+
+        strong = find(find(find(doc, 'count_div'), 'count_h1'), 'strong')
+        return int(re.sub(r'[^\d]', '', text(strong)))
+
+    def rental_data(self, doc, record=None):
+        '''
+        Scrapes the rental data of interest from a parsed property page into the given
+        record (a new dict if none is given) and returns it. Fields are filled in as they are
+        found, so a failure part way through leaves the earlier fields in place
+        '''
+
+        if record is None:
+            record = {}
+
+        record['name'] = text(find(doc, 'name'))
+        record['cost_text'] = text(find(doc, 'cost'))
+
+        # Extract room and parking details using regex
+        rooms = [text(feature) for feature in XPATHS['feature_text'](find(doc, 'features'))]
+        record['rooms'] = [re.findall(r'\d+\s[A-Za-z]+', feature)[0] for feature in rooms if 'Bed' in feature or 'Bath' in feature]
+        record['parking'] = [re.findall(r'\S+\s[A-Za-z]+', feature)[0] for feature in rooms if 'Parking' in feature]
+
+        record['desc'] = text(find(doc, 'desc'), separator='\n').strip()
+        record['property_type'] = text(find(find(doc, 'type_div'), 'type_span'))
+
+        # Extract date available and bond from the summary strip
+        date_available = np.nan
+        bond = np.nan
+
+        for li in XPATHS['li'](find(find(doc, 'strip_div'), 'strip_ul')):
+            strong_tag = find_optional(li, 'strong')
+            if strong_tag is not None:
+                strong_text = text(strong_tag, strip=True)
+                li_text = text(li, strip=True)
+                if "Date Available:" in li_text:
+                    date_available = strong_text
+                elif "Bond" in li_text:
+                    bond = strong_text
+
+        record['date_available'] = date_available
+        record['bond'] = bond
+
+        # Scrape additional property features if available
+        property_features = []
+        node = find_optional(doc, 'extra_div')
+        for key in ['expander', 'expander_content', 'extra_ul']:
+            if node is None:
+                break
+            node = find_optional(node, key)
+        if node is not None:
+            property_features = [text(li, strip=True) for li in XPATHS['extra_li'](node)]
+
+        record['property_features'] = property_features
+
+        # Scrape latitude and longitude for the property from the map link
+        map_ul = find(find(find(find(doc, 'map_div'), 'map_inner'), 'map_default'), 'map_ul')
+        map_link = find_optional(XPATHS['map_li'](map_ul)[1], 'map_link')
+
+        latitude, longitude = None, None
+
+        # Extract coordinates from the map URL if available
+        if map_link is not None and map_link.get('href') is not None:
+            destination = parse_qs(urlparse(map_link.get('href')).query).get('destination', [None])[0]
+            if destination:
+                coordinates = destination.split(',')
+                if len(coordinates) == 2:
+                    latitude, longitude = coordinates
+
+        record['coordinates'] = [latitude, longitude]
+
+        return record
+
+
+############################################# BACKENDS #############################################
+
+PARSERS = {
+    SoupParser.name: SoupParser,
+    LxmlParser.name: LxmlParser
+}
+
+
+
+def get_parser(parser=None):
+    '''
+    Returns a parser backend given its name ('soup' or 'lxml') or an existing parser,
+    defaulting to DEFAULT_PARSER
+    '''
+
+    if parser is None:
+        parser = DEFAULT_PARSER
+    if isinstance(parser, str):
+        return PARSERS[parser]()
+    return parser
+
+
+
+def benchmark_parsers(fixture_dir=FIXTURE_DIR, repeats=200):
+    '''
+    Parses the saved search and property fixture pages with every backend 'repeats' times, 
+    checks the backends agree, and returns the pages per second of each
+    '''
+
+    with open(os.path.join(fixture_dir, "search.html"), encoding="utf-8") as file:
+        search_html = file.read()
+    with open(os.path.join(fixture_dir, "listing.html"), encoding="utf-8") as file:
+        listing_html = file.read()
+
+    results = {}
+    outputs = {}
+
+    for name, parser_class in PARSERS.items():
+        parser = parser_class()
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            search_doc = parser.parse(search_html)
+            links = parser.listing_links(search_doc, "https://www.domain.com.au")
+            count = parser.listing_count(search_doc)
+            record = parser.rental_data(parser.parse(listing_html))
+        elapsed = time.perf_counter() - start
+
+        results[name] = 2 * repeats / elapsed
+        outputs[name] = (links, count, record)
+        print(f"{name}: {results[name]:.1f} pages/s")
+
+    # Every backend should scrape the same values (nan != nan, so compare as strings)
+    if len({str(output) for output in outputs.values()}) > 1:
+        print("Warning: the parser backends disagree on the fixture pages")
+
+    return results
@@ -0,0 +1,170 @@
+## Python script with a compressed, content-addressed cache of the raw domain.com property pages, ##
+## so the parsers can be re-run offline when the site's markup changes ##
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from scripts.parallelised_scrape import parse_rental_page
+from scripts.listing_parsers import get_parser
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CACHE_DIR = "../data/landing/domain/page_cache"
+METADATA_PATH = "../data/landing/all_properties_metadata.json"
+
+
+
+def compress(data, compression):
+    '''
+    Compresses the given bytes with 'zstd' or 'gzip'
+    '''
+
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+
+def decompress(data, compression):
+    '''
+    Decompresses the given bytes with 'zstd' or 'gzip'
+    '''
+
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+
+class PageCache:
+    '''
+    Stores each fetched page once under the sha256 of its html (so identical pages share a
+    file), compressed with zstd if the zstandard package is installed and gzip otherwise.
+    An append-only index.jsonl maps each url to its latest page, and is read once and kept
+    in memory after that. Safe to share between threads
+    '''
+
+    def __init__(self, cache_dir=CACHE_DIR, compression=None):
+        self.cache_dir = cache_dir
+        self.compression = compression or ('zstd' if zstandard else 'gzip')
+        self.extension = {'zstd': 'zst', 'gzip': 'gz'}[self.compression]
+        self.index_path = os.path.join(cache_dir, "index.jsonl")
+        self.entries = None  # url -> path of its latest page, read on first use
+        self.lock = threading.Lock()
+
+        if not os.path.exists(os.path.join(cache_dir, "objects")):
+            os.makedirs(os.path.join(cache_dir, "objects"))
+
+    def put(self, url, html):
+        '''
+        Saves the page html for the url and returns the path of its cached object
+        '''
+
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = os.path.join("objects", digest[:2], f"{digest}.html.{self.extension}")
+        full_path = os.path.join(self.cache_dir, object_path)
+
+        # Only write the page if this exact html hasn't been seen before
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            temp_path = f"{full_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(compress(data, self.compression))
+            os.replace(temp_path, full_path)
+
+        with self.lock:
+            with open(self.index_path, 'a') as index:
+                index.write(json.dumps({'url': url, 'object': object_path, 'fetched_at': time.time()}) + "\n")
+            if self.entries is not None:
+                self.entries[url] = full_path
+
+        return full_path
+
+    def index(self):
+        '''
+        Returns a dictionary of url -> path of the latest cached page for that url
+        '''
+
+        with self.lock:
+            return dict(self._load_index())
+
+    def get(self, url):
+        '''
+        Returns the latest cached html for the url, or None if it hasn't been cached
+        '''
+
+        with self.lock:
+            object_path = self._load_index().get(url)
+        return read_cached_page(object_path) if object_path else None
+
+    def _load_index(self):
+        # Reads index.jsonl the first time it is needed, later entries replace earlier ones.
+        # Only call with the lock held
+        if self.entries is None:
+            self.entries = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as index:
+                    for line in index:
+                        entry = json.loads(line)
+                        self.entries[entry['url']] = os.path.join(self.cache_dir, entry['object'])
+        return self.entries
+
+
+
+def read_cached_page(object_path):
+    '''
+    Reads and decompresses a cached page, using its extension to pick the compression
+    '''
+
+    compression = 'zstd' if object_path.endswith('.zst') else 'gzip'
+    with open(object_path, 'rb') as file:
+        return decompress(file.read(), compression).decode('utf-8')
+
+
+
+def reparse_cached_page(object_path, parser_name):
+    '''
+    Reads and parses one cached property page in a worker process. Returns the record and
+    the error message, if any
+    '''
+
+    return parse_rental_page(read_cached_page(object_path), parser_name)
+
+
+
+def reparse_cache(cache_dir=CACHE_DIR, out_path=METADATA_PATH, parser=None, workers=None):
+    '''
+    Rebuilds the property metadata from the cached pages without any network access,
+    parsing them across 'workers' processes (one per core by default). Saves the result to
+    out_path (skipped if None) in the same format as the live scrape, and returns it
+    '''
+
+    entries = PageCache(cache_dir).index()
+    parser_name = get_parser(parser).name
+    property_metadata = {}
+
+    print(f"Re-parsing {len(entries)} cached pages...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(reparse_cached_page, entries.values(), [parser_name] * len(entries), chunksize=64)
+
+        for property_url, (record, error) in tqdm(zip(entries, results), total=len(entries)):
+            property_metadata[property_url] = record
+            if error:
+                print(f"Issue with {property_url}: {error}")
+
+    if out_path:
+        with open(out_path, 'w') as f:
+            json.dump(property_metadata, f)
+        print(f"Saved {out_path}")
+
+    return property_metadata
@@ -1,116 +1,175 @@
 ## Python script with the functions necessary to scrape the rental property data from domain.com ##
 
-import re
+import os
+import time
+from queue import Queue, Empty
 from tqdm import tqdm
-from bs4 import BeautifulSoup
-from urllib.request import urlopen, Request
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import requests
 from collections import defaultdict
-import numpy as np
-from urllib.parse import urlparse, parse_qs
+from scripts.crawl_journal import page_validators
+from scripts.listing_parsers import get_parser
+from scripts.rate_limiter import limited_get
+
+
+# Define headers to mimic a browser request
+HEADERS = {'User-Agent': "PostmanRuntime/7.6.0"}
+
+# Price limits searched, and how many results domain.com will show for one search
+MIN_PRICE = 150
+MAX_PRICE = 3000
+RESULTS_PER_PAGE = 20
+MAX_PAGES = 50
 
 
 ############################## FUNCTIONS TO FIND ALL THE RENTAL URLS ##############################
 
-def fetch_links_for_price_range(baseurl, price_range, page):
+def fetch_links_for_price_range(baseurl, price_range, page, parser=None):
     '''
-    Fetches the links from a given page for a specific price range.
+    Fetches the links from a given page for a specific price range, parsing it with the
+    given parser backend (see listing_parsers.get_parser)
     '''
+
+    parser = get_parser(parser)
     
-    url = f"{baseurl}/rent/?price={price_range}&excludedeposittaken=1&sort=price-asc&state=vic&page={page}"
+    url = build_search_url(baseurl, price_range, page)
     print(f"Fetching {url}")
     
     try:
-        response = urlopen(Request(url, headers={'User-Agent':"PostmanRuntime/7.6.0"}))
-        bs_object = BeautifulSoup(response, "lxml")
+        response = limited_get(url, headers=HEADERS)
+        response.raise_for_status()
+        doc = parser.parse(response.content)
     except Exception as e:
         print(f"Error fetching page {page} for price range {price_range}: {e}")
         return []
     
-    # Find the listings (ul element with specific data-testid attribute)
-    results = bs_object.find("ul", {"data-testid": "results"})
-    if not results:
+    links = parser.listing_links(doc, baseurl)
+    if links is None:
         print(f"No listings found on page {page} for price range {price_range}.")
         return []
     
-    # Find all href (a) tags that are from the base_url website
-    index_links = results.findAll("a", href=re.compile(f"{baseurl}/*"))
-    
-    # Filter for links with class 'address'
-    links = [link['href'] for link in index_links if 'address' in link.get('class', [])]
-    
     return links
 
 
 
-def generate_url_list(baseurl):
+def build_search_url(baseurl, price_range, page=None):
+    '''
+    Builds the domain.com search url for the given price range, and page if given
+    '''
+
+    url = f"{baseurl}/rent/?price={price_range}&excludedeposittaken=1&sort=price-asc&state=vic"
+    if page is not None:
+        url = f"{url}&page={page}"
+    return url
+
+
+
+def price_bands():
+    '''
+    Returns the starting (min, max) price bands to search: $50 steps from 150 to 3000,
+    then 3000 upwards (a max of None means no upper limit)
+    '''
+
+    return [(price, price + 50) for price in range(MIN_PRICE, MAX_PRICE, 50)] + [(MAX_PRICE, None)]
+
+
+
+def format_price_range(min_price, max_price):
+    '''
+    Formats a price band into domain.com's price filter, e.g. '150-200' or '3000-any'
+    '''
+
+    return f"{min_price}-any" if max_price is None else f"{min_price}-{max_price}"
+
+
+
+def split_price_band(min_price, max_price):
+    '''
+    Splits a price band in half, or returns None if it is already a single dollar wide.
+    An open-ended band is split at double its minimum price (up to $100,000 per week)
+    '''
+
+    if max_price is None:
+        if min_price >= 100000:
+            return None
+        return [(min_price, min_price * 2), (min_price * 2, None)]
+    if max_price - min_price <= 1:
+        return None
+
+    mid_price = (min_price + max_price) // 2
+    return [(min_price, mid_price), (mid_price, max_price)]
+
+
+
+def num_result_pages(total_listings):
+    '''
+    Returns how many search result pages exist for the given number of listings, up to 
+    the site's page cap
+    '''
+
+    return min(MAX_PAGES, -(-total_listings // RESULTS_PER_PAGE))
+
+
+
+def partition_price_band(baseurl, min_price, max_price, parser=None):
+    '''
+    Reads the listing count for a price band from its first page and splits the band in 
+    half recursively until every part fits under the page cap. Returns a list of 
+    (price_range, total_listings, first_page_links) for the final bands
+    '''
+
+    parser = get_parser(parser)
+    price_range = format_price_range(min_price, max_price)
+    check_url = build_search_url(baseurl, price_range)
+
+    try:
+        response = limited_get(check_url, headers=HEADERS)
+        response.raise_for_status()
+        doc = parser.parse(response.content)
+    except Exception as e:
+        print(f"Error fetching page {check_url}: {e}")
+        return []
+
+    # Find the total number of listings for the current price range
+    try:
+        total_listings = parser.listing_count(doc)
+    except AttributeError:
+        print(f"Could not find listing count for {price_range}, assuming no listings.")
+        total_listings = 0
+
+    # Keep splitting while the band holds more listings than the pages can show
+    halves = split_price_band(min_price, max_price)
+    if total_listings > MAX_PAGES * RESULTS_PER_PAGE and halves:
+        return [band for half in halves for band in partition_price_band(baseurl, *half, parser)]
+
+    print(f"Found {total_listings} listings for price range {price_range}")
+    return [(price_range, total_listings, parser.listing_links(doc, baseurl) or [])]
+
+
+
+def generate_url_list(baseurl, parser=None):
     '''
     Generates a list of VIC property urls that uses threading to fetch multiple pages 
-    concurrently for each price range.
+    concurrently for each price range. Price bands are split until each fits under the 
+    page cap, and only the pages that exist for each band are fetched
     '''
 
+    parser = get_parser(parser)
     print("\nGenerating the list of links...\n")
     url_links = []
-    min_price = 150
-    max_price = 3000
     
     with ThreadPoolExecutor(max_workers=20) as executor:
+
+        # Partition every starting price band concurrently
+        band_futures = [executor.submit(partition_price_band, baseurl, *band, parser) for band in price_bands()]
+        bands = [band for future in band_futures for band in future.result()]
+
+        # Page 1 was already fetched with the count, so only the remaining pages are needed
         futures = []
-        
-        # Looping through price ranges (150 to 3000 in steps of 50)
-        while min_price <= max_price:
-            if min_price >= 3000:
-                price_range = "3000-any"
-                price_increment = 50
-            else:
-                price_range = f"{min_price}-{min_price + 50}"
-                price_increment = 50
-            
-            print(f"\nFetching listings for price range: {price_range}\n")
-            
-            # URL to check how many properties are available for the price range
-            check_url = f"{baseurl}/rent/?price={price_range}&excludedeposittaken=1&sort=price-asc&state=vic"
-            try:
-                response = urlopen(Request(check_url, headers={'User-Agent':"PostmanRuntime/7.6.0"}))
-                bs_object = BeautifulSoup(response, "lxml")
-            except Exception as e:
-                print(f"Error fetching page {check_url}: {e}")
-                min_price += 50
-                continue
-            
-            # Find the total number of listings for the current price range
-            try:
-                properties_div = bs_object.find("div", {"class": "css-9ny10o"})
-                properties_count_str = properties_div.find("h1", {"class": "css-ekkwk0"}).find("strong").text
-                total_listings = int(re.sub(r'[^\d]', '', properties_count_str))
-                print(f"Found {total_listings} listings for price range {price_range}")
-            except AttributeError:
-                print(f"Could not find listing count for {price_range}, assuming no listings.")
-                total_listings = 0
-            
-            # If more than 1000 listings, break the range into $5 intervals
-            if total_listings > 1000:
-                price_increment = 5
-            
-            # Adjust the price range increment accordingly ($50 or $5)
-            current_min_price = min_price
-            
-            while current_min_price < min_price + 50:
-                if current_min_price >= 3000:
-                    price_range = "3000-any"
-                else:
-                    price_range = f"{current_min_price}-{current_min_price + price_increment}"
-                
-                print(f"\nFetching listings for sub-range: {price_range}\n")
-                
-                # Fetch pages for the current sub-range concurrently
-                for page in range(1, 51):  # Up to 50 pages
-                    futures.append(executor.submit(fetch_links_for_price_range, baseurl, price_range, page))
-                
-                current_min_price += price_increment
-            
-            min_price += 50
+        for price_range, total_listings, first_page_links in bands:
+            url_links.extend(first_page_links)
+            for page in range(2, num_result_pages(total_listings) + 1):
+                futures.append(executor.submit(fetch_links_for_price_range, baseurl, price_range, page, parser))
         
         # Collect results as they complete
         for future in tqdm(as_completed(futures), total=len(futures)):
@@ -122,120 +181,207 @@ def generate_url_list(baseurl):
 
 ######################### FUNCTIONS TO FETCH ALL THE DATA FOR EACH RENTAL #########################
 
-def fetch_rental_data(property_url, property_metadata):
+def fetch_rental_data(property_url, property_metadata, journal=None, parser=None, cache=None):
     '''
-    Fetches the rental data of interest for a particular property
+    Fetches the rental data of interest for a particular property, recording the result
+    in the crawl journal and saving the raw page to the PageCache if they are given
     '''
 
-    headers = {'User-Agent': "PostmanRuntime/7.6.0"} # Define headers to mimic a browser request
+    parser = get_parser(parser)
+
     try:
         # Send a GET request to the property URL
-        response = requests.get(property_url, headers=headers)
+        response = limited_get(property_url, headers=HEADERS)
+        response.raise_for_status()  # Error pages are never cached or parsed
         html = response.text
 
-        # Parse the HTML content using BeautifulSoup 
-        bs_object = BeautifulSoup(html, "lxml")
-
-        # Scrape and store the property name
-        property_metadata[property_url]['name'] = bs_object.find("h1", {"class": "css-164r41r"}).text
-
-        # Scrape and store the property cost
-        property_metadata[property_url]['cost_text'] = bs_object.find("div", {"data-testid": "listing-details__summary-title"}).text
-
-        # Extract room and parking details using regex
-        rooms = bs_object.find("div", {"data-testid": "property-features"}).findAll("span", {"data-testid": "property-features-text-container"})
-        property_metadata[property_url]['rooms'] = [
-            re.findall(r'\d+\s[A-Za-z]+', feature.text)[0] for feature in rooms if 'Bed' in feature.text or 'Bath' in feature.text
-        ]
-        property_metadata[property_url]['parking'] = [
-            re.findall(r'\S+\s[A-Za-z]+', feature.text)[0] for feature in rooms if 'Parking' in feature.text
-        ]
-
-        # Scrape and store property description
-        property_metadata[property_url]['desc'] = bs_object.find("p").get_text(separator='\n').strip()
-
-
-        # Scrape and store the property type (e.g., house, apartment)
-        property_metadata[property_url]['property_type'] = bs_object.find(
-            "div", {"data-testid": "listing-summary-property-type"}).find("span", {"class": "css-in3yi3"}).text
-
-        # Extract additional details such as date available and bond using list items
-        ul_element = bs_object.find("div", {"data-testid": "strip-content-list"}).find("ul", {"data-testid": "listing-summary-strip"})
-        li_elements = ul_element.find_all("li")
-
-        date_available = np.nan
-        bond = np.nan
-
-        for li in li_elements:
-            strong_tag = li.find("strong")
-            if strong_tag:
-                text = strong_tag.get_text(strip=True)
-                li_text = li.get_text(strip=True)
-                if "Date Available:" in li_text:
-                    date_available = text
-                elif "Bond" in li_text:
-                    bond = text
-
-        # Store the date available and bond information
-        property_metadata[property_url]['date_available'] = date_available
-        property_metadata[property_url]['bond'] = bond
-
-        # Scrape additional property features if available
-        listing_details_div = bs_object.find("div", {"data-testid": "listing-details__additional-features"})
-        property_features = []
-        if listing_details_div:
-            expander_wrapper = listing_details_div.find("div", {"data-testid": "expander-wrapper"})
-            if expander_wrapper:
-                content_div = expander_wrapper.find("div", {"class": "noscript-expander-content css-1mnayj9"})
-                if content_div:
-                    ul_element = content_div.find("ul", {"class": "css-4ewd2m"})
-                    if ul_element:
-                        li_elements = ul_element.find_all("li", {"class": "css-vajaaq"})
-                        property_features = [li.get_text(strip=True) for li in li_elements]
-
-        property_metadata[property_url]['property_features'] = property_features
-
-        # Scrape latitude and longitude for the property from the map link
-        map_div = bs_object.find("div", {"data-testid": "listing-details__map"}) \
-            .find("div", {"class": "css-yjd8ae"}) \
-            .find("div", {"class": "listing-details__location-map--default css-79elbk"}) \
-            .find("ul", {"class": "css-1vlxv67"}) \
-            .find_all("li", {"class": "css-1g3iwis"})[1] \
-            .find("a", {"class": "css-1aszeu9"})
-
-        latitude, longitude = None, None
-
-        # Extract coordinates from the map URL if available
-        if map_div and 'href' in map_div.attrs:
-            href = map_div['href']
-            destination = parse_qs(urlparse(href).query).get('destination', [None])[0]
-            if destination:
-                coordinates = destination.split(',')
-                if len(coordinates) == 2:
-                    latitude, longitude = coordinates
-
-        property_metadata[property_url]['coordinates'] = [latitude, longitude]
+        if cache:
+            cache.put(property_url, html)
+
+        # Parse the HTML content and scrape the details straight into this property's entry
+        parser.rental_data(parser.parse(html), property_metadata[property_url])
+
+        if journal:
+            journal.mark_done(property_url, property_metadata[property_url], page_validators(html, response.headers))
 
     except Exception as e:
         print(f"Issue with {property_url}: {e}")
+        if journal:
+            journal.mark_failed(property_url, e, property_metadata.get(property_url))
 
 
 
-def fetch_all_rental_data(url_links):
+def fetch_all_rental_data(url_links, journal=None, parser=None, cache=None):
     '''
-    Fetches all the data for rentals in VIC using parallelisation
+    Fetches all the data for rentals in VIC using parallelisation. If a CrawlJournal is
+    given, each property is saved to it as soon as it is scraped and any urls already done
+    in the journal are skipped, so an interrupted run can be resumed by calling this again.
+    If a PageCache is given, every fetched page is saved to it for offline re-parsing
     '''
 
     property_metadata = defaultdict(dict) # Initialise a dictionary
+    parser = get_parser(parser)
+
+    # Only fetch the urls the journal hasn't finished yet
+    todo_links = url_links
+    if journal:
+        journal.add_urls(url_links)
+        todo_links = journal.todo_urls(url_links)
+        print(f"{len(url_links) - len(todo_links)} properties already scraped, {len(todo_links)} to go")
 
     # Use ThreadPoolExecutor to fetch property data concurrently
     with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(fetch_rental_data, url, property_metadata): url for url in url_links}
+        futures = {executor.submit(fetch_rental_data, url, property_metadata, journal, parser, cache): url for url in todo_links}
 
         # Display a progress bar as tasks complete
         for future in tqdm(as_completed(futures), total=len(futures)):
             future.result()  # To raise exceptions if any occurred and retrieve results
 
-    return property_metadata # Return all the data 
+    # The journal also holds the properties scraped in earlier runs
+    if journal:
+        property_metadata = defaultdict(dict, journal.records(url_links))
+
+    return property_metadata # Return all the data
 
 
+########################### TWO-STAGE PIPELINE: FETCH IN THREADS, PARSE IN PROCESSES ###########################
+
+def fetch_rental_page(session, property_url, page_queue, cache=None):
+    '''
+    Downloads the raw html for a property (saving it to the PageCache if given) and puts 
+    (url, html, validators, error) on the queue for the parse stage. Blocks while the queue 
+    is full, so fetching can't run too far ahead of parsing
+    '''
+
+    try:
+        response = limited_get(property_url, session, headers=HEADERS)
+        response.raise_for_status()  # Error pages are never cached or parsed
+        if cache:
+            cache.put(property_url, response.text)
+        page_queue.put((property_url, response.text, page_validators(response.text, response.headers), None))
+    except Exception as e:
+        page_queue.put((property_url, None, None, e))
+
+
+
+def parse_rental_page(html, parser_name):
+    '''
+    Parses a property page in a worker process. Returns the record (partly filled in if 
+    parsing failed part way) and the error message, if any
+    '''
+
+    parser = get_parser(parser_name)
+    record = {}
+    try:
+        parser.rental_data(parser.parse(html), record)
+        return record, None
+    except Exception as e:
+        return record, str(e)
+
+
+
+def fetch_all_rental_data_pipeline(url_links, journal=None, parser=None, fetch_workers=10, 
+                                   parse_workers=None, queue_size=100, cache=None):
+    '''
+    Same as fetch_all_rental_data, but split into two stages so parsing doesn't hold up the
+    downloads: 'fetch_workers' threads download raw html into a queue of at most 'queue_size' 
+    pages, and a pool of 'parse_workers' processes (one per core by default) parses them. 
+    The progress bar shows the queue depth and the fetch and parse rates
+    '''
+
+    property_metadata = defaultdict(dict) # Initialise a dictionary
+    parser_name = get_parser(parser).name
+
+    # Only fetch the urls the journal hasn't finished yet
+    todo_links = url_links
+    if journal:
+        journal.add_urls(url_links)
+        todo_links = journal.todo_urls(url_links)
+        print(f"{len(url_links) - len(todo_links)} properties already scraped, {len(todo_links)} to go")
+
+    page_queue = Queue(maxsize=queue_size)
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=fetch_workers))
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=fetch_workers))
+
+    start = time.perf_counter()
+    num_fetched = 0
+    num_parsed = 0
+
+    def store_parsed(done):
+        '''
+        Stores the records from the finished parse jobs
+        '''
+
+        nonlocal num_parsed
+        for future in done:
+            property_url, validators = parsing.pop(future)
+            record, error = future.result()
+            property_metadata[property_url] = record
+            num_parsed += 1
+            progress.update()
+
+            if error:
+                print(f"Issue with {property_url}: {error}")
+                if journal:
+                    journal.mark_failed(property_url, error, record)
+            elif journal:
+                journal.mark_done(property_url, record, validators)
+
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetchers, \
+         ProcessPoolExecutor(max_workers=parse_workers) as parsers, \
+         tqdm(total=len(todo_links)) as progress:
+
+        fetches = [fetchers.submit(fetch_rental_page, session, url, page_queue, cache) for url in todo_links]
+
+        # Keep a couple of pages in hand per parse process
+        max_parsing = 2 * (parse_workers or os.cpu_count() or 1)
+        parsing = {}
+
+        try:
+            for _ in range(len(todo_links)):
+                property_url, html, validators, error = page_queue.get()
+                num_fetched += 1
+
+                if error is not None:
+                    print(f"Issue with {property_url}: {error}")
+                    if journal:
+                        journal.mark_failed(property_url, error)
+                    progress.update()
+                    continue
+
+                parsing[parsers.submit(parse_rental_page, html, parser_name)] = (property_url, validators)
+
+                # Wait for the parse stage if it has fallen behind, otherwise collect whatever is ready
+                if len(parsing) >= max_parsing:
+                    done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                else:
+                    done = [future for future in parsing if future.done()]
+                store_parsed(done)
+
+                elapsed = time.perf_counter() - start
+                progress.set_postfix(queue=page_queue.qsize(), fetch_rate=f"{num_fetched / elapsed:.1f}/s",
+                                     parse_rate=f"{num_parsed / elapsed:.1f}/s")
+
+            store_parsed(wait(parsing).done)
+
+        except BaseException:
+            # Stop fetching and keep emptying the queue until the running fetches finish, otherwise
+            # they stay blocked on the full queue and leaving the executor hangs instead of failing
+            for future in fetches:
+                future.cancel()
+            while not all(future.done() for future in fetches):
+                try:
+                    page_queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            raise
+
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {num_fetched} pages ({num_fetched / elapsed:.1f}/s), parsed {num_parsed} ({num_parsed / elapsed:.1f}/s)")
+
+    # The journal also holds the properties scraped in earlier runs
+    if journal:
+        property_metadata = defaultdict(dict, journal.records(url_links))
+
+    return property_metadata # Return all the data
@@ -2,12 +2,17 @@
 
 import re
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
-from shapely.geometry import Point
 import geopandas as gpd
 import numpy as np
 import matplotlib.pyplot as plt
-import statsmodels.api as sm
+from tqdm import tqdm
+from scripts.feature_store import get_feature_store, EXTERNAL_DATA_DIR
+from scripts.extrapolators import get_extrapolator
+from scripts.sa2_locator import get_sa2_locator
+from scripts.preprocess_oldlistings import drop_duplicate_listings, parse_addresses
 
 
 
@@ -57,6 +62,48 @@ def extract_weekly_cost(cost_text):
 
 
 
+# Combined pattern for extract_weekly_costs. Each alternative is anchored at the start and
+# skips ahead lazily, so the alternatives are tried in the same priority order as the
+# patterns in extract_weekly_cost, each matching at its leftmost position in the text
+WEEKLY_COST_PATTERN = re.compile(
+    r"^(?:.*?(?P<weekly>\$[\d,]+\.?\d*)\s*(?:per week|pw|p/w|p\.w\.|week)"
+    r"|.*?(?P<weekly_word>\$[\d,]+\.?\d*)\s*weekly"
+    r"|.*?(?P<annual>\$[\d,]+\.?\d*)\s*(?:p\.a\.|pa|annum|per year|annual|year)"
+    r"|.*?(?P<monthly>\$[\d,]+\.?\d*)\s*(?:p/m|month|pm|p\.m\.)"
+    r"|(?=.*?\bseason\b).*?\$(?P<seasonal>[\d,]+\.?\d*)"
+    r"|\s*\$?(?P<number>[\d,]+\.?\d*)\s*$)",
+    re.IGNORECASE | re.DOTALL)
+
+# What to divide each kind of cost by to get the weekly cost
+WEEKLY_COST_DIVISORS = {'weekly': 1, 'weekly_word': 1, 'annual': 52, 'monthly': 4.3, 'seasonal': 13, 'number': 1}
+
+
+
+def extract_weekly_costs(cost_texts):
+    '''
+    Vectorised version of extract_weekly_cost: takes a Series of cost text descriptions and
+    returns a Series of weekly prices (NaN where no price could be found), classifying every
+    distinct text in a single pass of one combined regex
+    '''
+
+    # Listing texts repeat a lot, so only run the regex on each distinct text once
+    codes, unique_texts = pd.factorize(cost_texts)
+    matches = pd.Series(unique_texts, dtype=object).str.extract(WEEKLY_COST_PATTERN).to_numpy()
+
+    # Each text matches at most one of the named groups, take that one
+    matched = pd.notna(matches)
+    group = matched.argmax(axis=1)
+    amounts = pd.Series(matches[np.arange(len(matches)), group], dtype=object)
+    amounts = pd.to_numeric(amounts.str.replace('$', '', regex=False).str.replace(',', '', regex=False),
+                            errors='coerce')
+    weekly_costs = amounts.to_numpy() / np.array(list(WEEKLY_COST_DIVISORS.values()))[group]
+
+    # Map the costs of the distinct texts back onto every row (missing texts have code -1)
+    weekly_costs = np.append(weekly_costs, np.nan)[codes]
+    return pd.Series(weekly_costs, index=cost_texts.index, name=cost_texts.name)
+
+
+
 def extract_house_details(df):
     """
     Extracts the address, suburb, and postcode from the 'name' column of the DataFrame,
@@ -75,6 +122,10 @@ def extract_house_details(df):
     df['suburb'] = df['suburb'].str.lower()
     df['postcode'] = df['postcode'].str.lower()
 
+    # Split the address into its parts, the same way as the oldlisting addresses, so the two
+    # can be matched on them
+    df[['unit_number', 'street_number', 'street_name']] = parse_addresses(df['address'])
+
     df['beds'] = df['rooms'].apply(lambda x: int(x[0].split()[0]) if isinstance(x, list) and len(x) > 0 else 0)
     df['baths'] = df['rooms'].apply(lambda x: int(x[1].split()[0]) if isinstance(x, list) and len(x) > 1 else 0)
 
@@ -197,26 +248,24 @@ def extract_suburb(address):
 
 
 
-def combine_SA2(df):
+def combine_SA2(df, locator=None):
     '''
-    Accepts a dataframe and column as input. The 'column' input is a string which corresponds to the column name within the dataframe that specifies the coordinates of each listing.
-    Returns a dataframe, similar to the 'df' input, with SA2 information appended
+    Accepts a dataframe with 'longitude' and 'latitude' columns for each listing.
+    Returns a dataframe, similar to the 'df' input, with SA2 information appended. Regions are
+    found with the given SA2Locator, or the shared one for the SA2 shapefile by default
     '''
 
-    sf = gpd.read_file("../data/SA2/SA2_extracted/SA2_2021_AUST_GDA2020.shp") # read SA2 shapefile
-    sf = sf[sf['STE_NAME21'] == 'Victoria'] # remove all instances not in victoria
+    locator = locator or get_sa2_locator()
 
     # create geometry column in dataframe
     df = df.dropna(subset=['longitude'])
     df['longitude'] = df['longitude'].astype(float)
     df['latitude'] = df['latitude'].astype(float)
-    df['point'] = df.apply(lambda row: Point(row['longitude'], row['latitude']), axis=1)
+    df['point'] = gpd.points_from_xy(df['longitude'], df['latitude'])
 
-    gdf_points = gpd.GeoDataFrame(df, geometry='point', crs='EPSG:4326')
-    gdf_joined = gpd.sjoin(gdf_points, sf, how='left', predicate='within') # join our SA2 points with all listings
-    
-    # drop all irrelevant columns
-    gdf_joined = gdf_joined.drop(['index_right', 'CHG_FLAG21', 'CHG_LBL21',	'SA3_CODE21', 'LOCI_URI21', 'AUS_NAME21', 'AUS_CODE21', 'STE_NAME21', 'STE_CODE21', 'SA3_NAME21', 'SA4_CODE21', 'SA4_NAME21', 'GCC_CODE21'], axis=1)
+    # find the SA2 region of every listing and append its details
+    sa2_df = locator.sa2_attributes(df['longitude'], df['latitude'], index=df.index)
+    gdf_joined = gpd.GeoDataFrame(pd.concat([df, sa2_df], axis=1), geometry='point', crs='EPSG:4326')
 
     return gdf_joined
 
@@ -254,15 +303,18 @@ def get_majority_non_na_columns(df):
 
 
 
-def extend_data(df, data):
+# Years every dataset is extended to
+EXTENDED_YEARS = np.arange(2006, 2030, 1)
+
+
+
+def prepare_extension_data(df, clip_negative=True):
     '''
-    Function to extend range of data to our required years from 2006-2029
-    Accepts a dataframe 'df' with the data that needs to be extended, and a string 'data'
-    representing the name of the data we are extending
-    Displays a scatterplot of our newly extended data and returns a dataframe, 'extended_df',
-    which contains all of our extended data for our desired years
+    Cleans a table of yearly data before it is extended: keeps the years that are mostly
+    filled in, imputes the remaining gaps with the mean of the year and (optionally) raises
+    negative values to 0. Returns the cleaned dataframe and the rows that had gaps
     '''
-    
+
     df.replace('-', np.nan, inplace=True) # replace '-' values with NaN
 
     # extract the columns that have majority not NaN values
@@ -271,192 +323,237 @@ def extend_data(df, data):
 
     # impute any remaining NaN values with the mean
     rows_with_nan = df.index[df.isna().any(axis=1)].tolist()
-
-    # display the result
-    print("\nRows with NaN values:", rows_with_nan)
-
     df.fillna(df.mean(), inplace=True)
 
     # ensure no imputed values are below 0
-    df[df < 0] = 0
+    if clip_negative:
+        df[df < 0] = 0
+
+    return df, rows_with_nan
 
-    # create years to be extrapolated from
-    years = np.array(list(df))
-    extended_data = []
-    extended_years = np.arange(2006, 2030, 1)
 
-    # extend the data for each desired year for each SA2 region
-    for index, row in df.iterrows():
-        values = row.values  # get the values for the region
 
-        # set up data for OLS Regression
-        X = sm.add_constant(years)  # add constant term
-        y = values  
+def fit_trends(df, method=None, extended_years=EXTENDED_YEARS, **params):
+    '''
+    Fits a trend over the years (the columns of 'df') for every row at once with the given
+    extrapolator (see extrapolators.get_extrapolator, straight lines by default). Returns a
+    dataframe of the predicted values for each of the extended years, a dataframe with the
+    fitted coefficients of each row, and the fitted model
+    '''
 
-        # fit the model
-        model = sm.OLS(y, X).fit()
+    model = get_extrapolator(method, **params).fit(np.array(list(df), dtype=float), df.to_numpy(dtype=float))
 
-        # similarly, set up prediciton data
-        extended_X = sm.add_constant(extended_years)  
+    extended_df = pd.DataFrame(model.predict(extended_years), columns=extended_years, index=df.index)
+    coefficients_df = pd.DataFrame(model.params(), index=df.index)
 
-        extended_values = model.predict(extended_X)
+    return extended_df, coefficients_df, model
 
-        # ensure no extrapolated values are below 0
-        extended_values[extended_values < 0] = 0
-        
-        extended_data.append(extended_values)
 
 
-    # convert to dataframe
-    extended_df = pd.DataFrame(extended_data, columns=extended_years, index=df.index)
+def plot_extension(df, extended_df, data, legend_title, n_samples=None):
+    '''
+    Plots the extended data of each row (or a sample of n_samples rows) as a line, along with
+    its original data points
+    '''
 
-    # now lets plot out data:
-    sampled_regions = df.sample(n=10, random_state=13)
+    rows = df if n_samples is None else df.sample(n=min(n_samples, len(df)), random_state=13)
+    years = np.array(list(df))
 
     # create colours
-    colors = plt.cm.viridis(np.linspace(0, 1, len(sampled_regions)))
+    colors = plt.cm.viridis(np.linspace(0, 1, len(rows)))
 
     plt.figure(figsize=(10, 6))
-    for color, (index, row) in zip(colors, sampled_regions.iterrows()):
+    for color, (index, row) in zip(colors, rows.iterrows()):
         # plot extended data
-        plt.plot(extended_years, extended_df.loc[index], color=color, label=index + ' Extended')
+        plt.plot(extended_df.columns, extended_df.loc[index], color=color, label=index + ' Extended')
         # plot original data points
-        plt.plot(years, row, 'o', color=color)  
+        plt.plot(years, row, 'o', color=color)
 
     plt.title(f'Extrapolation of {data} to the years 2006-2029')
     plt.xlabel('Year')
     plt.ylabel(f'{data}')
-    plt.xticks(np.arange(2005, 2030, 1), rotation=90)
-    plt.legend(loc='center left', bbox_to_anchor=(1, 0.5), title="Regions")
+    plt.xticks(np.arange(2006, 2030, 1), rotation=90)
+    plt.legend(loc='center left', bbox_to_anchor=(1, 0.5), title=legend_title)
 
     plt.grid(True)
     plt.show()
 
+
+
+def extend_data(df, data, plot=False, return_coefficients=False, method=None, **params):
+    '''
+    Function to extend range of data to our required years from 2006-2029
+    Accepts a dataframe 'df' with the data that needs to be extended, and a string 'data'
+    representing the name of the data we are extending. The trend of each SA2 region is a
+    straight line unless another extrapolator 'method' (and its parameters) is given
+    Returns a dataframe, 'extended_df', which contains all of our extended data for our desired
+    years, along with the fitted coefficients of each SA2 region if return_coefficients is set.
+    Displays a scatterplot of a sample of the newly extended data if plot is set
+    '''
+
+    df, rows_with_nan = prepare_extension_data(df)
+
+    # display the result
+    print("\nRows with NaN values:", rows_with_nan)
+
+    # fit every SA2 region at once
+    extended_df, coefficients_df, _ = fit_trends(df, method, **params)
+
+    # ensure no extrapolated values are below 0
+    extended_df[extended_df < 0] = 0
+
+    if plot:
+        plot_extension(df, extended_df, data, "Regions", n_samples=10)
+
+    if return_coefficients:
+        return extended_df, coefficients_df
     return extended_df
 
 
 
-def extend_inflation(df, data):
+def extend_inflation(df, data, plot=False, return_coefficients=False, method=None, **params):
     '''
     Function to extend range of data to our required years from 2006-2029
     Accepts a dataframe 'df' with the data that needs to be extended, and a string 'data'
-    representing the name of the data we are extending
-    Displays a scatterplot of our newly extended data and returns a dataframe, 'extended_df',
-    which contains all of our extended data for our desired years
+    representing the name of the data we are extending. The trend of each row is a straight
+    line unless another extrapolator 'method' (and its parameters) is given
+    Returns a dataframe, 'extended_df', which contains all of our extended data for our desired
+    years, along with the fitted coefficients of each row if return_coefficients is set.
+    Displays a scatterplot of the newly extended data if plot is set
     '''
-    
-    df.replace('-', np.nan, inplace=True) # replace '-' values with NaN
-
-    # extract the columns that have majority not NaN values
-    columns = get_majority_non_na_columns(df)
-    df = df[columns]
 
-    # impute any remaining NaN values with the mean
-    rows_with_nan = df.index[df.isna().any(axis=1)].tolist()
+    df, rows_with_nan = prepare_extension_data(df, clip_negative=False)
 
     # Display the result
     print("\nRows with NaN values:", rows_with_nan)
 
-    df.fillna(df.mean(), inplace=True)
+    # fit every inflation type at once
+    extended_df, coefficients_df, _ = fit_trends(df, method, **params)
 
-    # create years to be extrapolated from
-    years = np.array(list(df))
-    extended_data = []
-    extended_years = np.arange(2006, 2030, 1)
+    if plot:
+        plot_extension(df, extended_df, data, "Inflation Type")
 
-    # extend the data for each desired year for each SA2 region
-    for index, row in df.iterrows():
-        values = row.values  # get the values for the region
+    if return_coefficients:
+        return extended_df, coefficients_df
+    return extended_df
 
-        # set up data for OLS Regression
-        X = sm.add_constant(years)  # add constant term
-        y = values  
 
-        # fit the model
-        model = sm.OLS(y, X).fit()
 
-        # similarly, set up prediciton data
-        extended_X = sm.add_constant(extended_years)  
+def extend_indicator(name, df, method=None, params=None, clip_negative=True, out_dir=EXTERNAL_DATA_DIR):
+    '''
+    Extends one indicator table with the given extrapolator, saves it as
+    out_dir/extrapolated_<name>.csv and returns the timings and fit diagnostics of the run
+    '''
 
-        extended_values = model.predict(extended_X)
-        
-        extended_data.append(extended_values)
+    start = time.perf_counter()
+    df, rows_with_nan = prepare_extension_data(df.copy(), clip_negative)
 
-    # convert to dataframe
-    extended_df = pd.DataFrame(extended_data, columns=extended_years, index=df.index)
+    fit_start = time.perf_counter()
+    extended_df, _, model = fit_trends(df, method, **(params or {}))
+    fit_seconds = time.perf_counter() - fit_start
 
-    # now lets plot our data
+    if clip_negative:
+        extended_df[extended_df < 0] = 0
 
-    # create our colours
-    colors = plt.cm.viridis(np.linspace(0, 1, len(extended_df)))
+    extended_df.to_csv(os.path.join(out_dir, f'extrapolated_{name}.csv'), index=True)
 
-    plt.figure(figsize=(10, 6))
+    # How well each region's trend fits the years it was fitted on
+    diagnostics = model.diagnostics(df.to_numpy(dtype=float))
 
-    # Iterate through each row in the DataFrame
-    for color, (index, row) in zip(colors, extended_df.iterrows()):
-        # Plot extended data
-        plt.plot(extended_years, row, color=color, label=index + ' Extended')
-        
-        # Plot original data points if needed (assuming you have original years and data)
-        plt.plot(years, df.loc[index], 'o', color=color)  
+    return {
+        'indicator': name,
+        'method': model.name,
+        'regions': len(df),
+        'years_used': len(df.columns),
+        'rows_imputed': len(rows_with_nan),
+        'mean_rmse': np.nanmean(diagnostics['rmse']),
+        'median_r2': np.nanmedian(diagnostics['r2']) if np.isfinite(diagnostics['r2']).any() else np.nan,
+        'worst_r2': np.nanmin(diagnostics['r2']) if np.isfinite(diagnostics['r2']).any() else np.nan,
+        'fit_seconds': fit_seconds,
+        'total_seconds': time.perf_counter() - start
+    }
 
-    plt.title(f'Extrapolation of {data} to the years 2006-2029')
-    plt.xlabel('Year')
-    plt.ylabel(f'{data}')
-    plt.xticks(np.arange(2006, 2030, 1), rotation=90)
-    plt.legend(loc='center left', bbox_to_anchor=(1, 0.5), title="Inflation Type")
 
-    plt.grid(True)
-    plt.show()
 
-    return extended_df
+def extend_indicators(indicators, method=None, out_dir=EXTERNAL_DATA_DIR, workers=None, clip_negative=True, **params):
+    '''
+    Extends a dictionary of indicator name -> table (one row per SA2 region, one column per
+    year) with the given extrapolator, across 'workers' processes (one per core by default).
+    Saves each result as out_dir/extrapolated_<name>.csv, ready for add_data, and returns
+    (and saves as out_dir/extrapolation_diagnostics.csv) the timings and fit diagnostics of
+    each indicator
+    '''
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extend_indicator, name, df, method, params, clip_negative, out_dir)
+                   for name, df in indicators.items()]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            results.append(future.result())
+
+    diagnostics_df = pd.DataFrame(results).sort_values('indicator').reset_index(drop=True)
+    diagnostics_df.to_csv(os.path.join(out_dir, 'extrapolation_diagnostics.csv'), index=False)
 
+    print(f"Extended {len(indicators)} indicators in {time.perf_counter() - start:.2f}s")
+    return diagnostics_df
 
 
-def add_data(df):
+
+# Extrapolated SA2 by year tables (see feature_store) added by add_data, and the column each one
+# becomes. Population isn't looked up by SA2, so it always falls back to the mean for the year
+EXTERNAL_FEATURES = [
+    ('extrapolated_homelessness_data', 'num_homeless_persons', True),
+    ('extrapolated_ave_household_size', 'avg_household_size', True),
+    ('extrapolated_business', 'num_businesses', True),
+    ('extrapolated_income', 'median_income', True),
+    ('extrapolated_median_age', 'median_age', True),
+    ('extrapolated_median_rent', 'median_weekly_rent', True),
+    ('extrapolated_percentage_aboriginal_torres_straight', 'percent_aboriginal_torres_strait_islander', True),
+    ('extrapolated_percentage_australian_citizen', 'percent_au_citizen', True),
+    ('extrapolated_percentage_overseas_born', 'percent_overseas_born', True),
+    ('extrapolated_percentage_rentals', 'percent_rental_properties', True),
+    ('extrapolated_population', 'population', False),
+    ('extrapolated_unemployment', 'percent_unemployed', True)
+]
+
+
+
+def add_data(df, store=None):
     '''
     Function created to add external datasets to our houses dataframes, inputting the correct
     values depending on each house's year and SA2 region.
     Accepts 'df' as input, a dataframe of house info. and returns the same dataframe with the 
     external data appended.
     Relies on 'df' having a 'year' column with type string and a 'SA2_NAME21' column.
+    The external tables come from the given FeatureStore, or the shared one for
+    ../data/curated/ by default, so the csvs are only parsed once per process.
     '''
 
-    extended_homelessness_df = pd.read_csv('../data/curated/extrapolated_homelessness_data.csv').set_index('SA2_name_2021')
-    extended_ave_household_size_df = pd.read_csv('../data/curated/extrapolated_ave_household_size.csv').set_index('SA2_name_2021')
-    extended_business_df = pd.read_csv('../data/curated/extrapolated_business.csv').set_index('SA2_name_2021')
-    extended_income_df = pd.read_csv('../data/curated/extrapolated_income.csv').set_index('SA2_name_2021')
-    extended_housing_index_df = pd.read_csv('../data/curated/extrapolated_housing_index.csv')
-    extended_cpi_without_housing_df = pd.read_csv('../data/curated/extrapolated_CPI_without_housing.csv')
-    extended_median_age_df = pd.read_csv('../data/curated/extrapolated_median_age.csv').set_index('SA2_name_2021')
-    extended_median_rent_df = pd.read_csv('../data/curated/extrapolated_median_rent.csv').set_index('SA2_name_2021')
-    extended_percentage_aboriginal_torres_straight_df = pd.read_csv('../data/curated/extrapolated_percentage_aboriginal_torres_straight.csv').set_index('SA2_name_2021')
-    extended_percentage_australian_citizen_df = pd.read_csv('../data/curated/extrapolated_percentage_australian_citizen.csv').set_index('SA2_name_2021')
-    extended_percentage_overseas_born_df = pd.read_csv('../data/curated/extrapolated_percentage_overseas_born.csv').set_index('SA2_name_2021')
-    extended_percentage_rentals_df = pd.read_csv('../data/curated/extrapolated_percentage_rentals.csv').set_index('SA2_name_2021')
-    extended_population_df = pd.read_csv('../data/curated/extrapolated_population.csv')
-    extended_unemployment_df = pd.read_csv('../data/curated/extrapolated_unemployment.csv').set_index('SA2_name_2021')
-
-
-    extended_dfs = [
-        (extended_homelessness_df, 'num_homeless_persons'),
-        (extended_ave_household_size_df, 'avg_household_size'),
-        (extended_business_df, 'num_businesses'),
-        (extended_income_df, 'median_income'),
-        (extended_median_age_df, 'median_age'),
-        (extended_median_rent_df, 'median_weekly_rent'),
-        (extended_percentage_aboriginal_torres_straight_df, 'percent_aboriginal_torres_strait_islander'),
-        (extended_percentage_australian_citizen_df, 'percent_au_citizen'),
-        (extended_percentage_overseas_born_df, 'percent_overseas_born'),
-        (extended_percentage_rentals_df, 'percent_rental_properties'),
-        (extended_population_df, 'population'),
-        (extended_unemployment_df, 'percent_unemployed')
-    ]
-
-    # Loop through each extended dataframe and merge it with df
+    store = store or get_feature_store()
+
+    extended_dfs = []
+    for table_name, col_name, indexed in EXTERNAL_FEATURES:
+        extended_df = store.table(table_name)
+        if not indexed:
+            extended_df = extended_df.reset_index(drop=True)
+        extended_dfs.append((extended_df, col_name))
+
+    extended_housing_index_df = store.table('extrapolated_housing_index')
+    extended_cpi_without_housing_df = store.table('extrapolated_CPI_without_housing')
+
+    # Look up each distinct (SA2, year) pair once, then attach every feature with a single merge
+    keys = pd.DataFrame({'SA2_NAME21': df['SA2_NAME21'].astype(str), 'year': df['year'].astype(str)})
+    features = keys.drop_duplicates().reset_index(drop=True)
     for extended_df, col_name in extended_dfs:
-        # Add the new column to the original DataFrame
-        df[col_name] = df.apply(lambda row: get_value_or_mean(row['SA2_NAME21'], row['year'], extended_df), axis=1)
+        features[col_name] = get_values_or_means(features['SA2_NAME21'], features['year'], extended_df)
+
+    features = keys.merge(features, on=['SA2_NAME21', 'year'], how='left')
+    for _, col_name in extended_dfs:
+        df[col_name] = features[col_name].to_numpy()
 
     # now lets do the same for inflation
     extended_housing_index_df = extended_housing_index_df.stack().reset_index()
@@ -477,6 +574,28 @@ def add_data(df):
 
 
 
+def get_values_or_means(sa2_names, years, extended_df):
+    '''
+    Vectorised version of get_value_or_mean: returns the values for each SA2 region and year
+    pair, imputing the mean for the year where the pair is not found
+    '''
+
+    # Melt the table into a long (SA2, year) -> value form, only keeping the years needed
+    year_cols = [year for year in pd.unique(years) if year in extended_df.columns]
+    long_df = extended_df[year_cols].stack(dropna=False)
+
+    pairs = pd.MultiIndex.from_arrays([sa2_names, years])
+    values = long_df.reindex(pairs).to_numpy(dtype=float)
+
+    # Pairs that aren't in the table get the mean for their year (found NaN values stay NaN)
+    year_means = extended_df[year_cols].mean()
+    missing = ~pairs.isin(long_df.index)
+    values[missing] = pd.Series(years).map(year_means).to_numpy(dtype=float)[missing]
+
+    return values
+
+
+
 def get_value_or_mean(sa2_name, year, extended_df):
     '''
     Function to extract and return the value or impute the mean 
@@ -494,10 +613,11 @@ def get_value_or_mean(sa2_name, year, extended_df):
     
 
 
-def split_by_gcc(listings_df, output_dir, data_name):
+def split_by_gcc(listings_df, output_dir, data_name, file_format='csv'):
     '''
     Splits the given dataframe by Greater Melbourne and the rest of Victoria
-    then saves the split dataframes in the given directory
+    then saves the split dataframes in the given directory, as csv or parquet
+    (which keeps list columns like the oldlisting dates and prices as lists)
     '''
 
     out_dir = f"{output_dir}/{data_name}/"
@@ -507,7 +627,7 @@ def split_by_gcc(listings_df, output_dir, data_name):
         os.makedirs(out_dir)
 
     # Drop duplicates
-    listings_df = listings_df.drop_duplicates()
+    listings_df = drop_duplicate_listings(listings_df)
 
     # Drop rows where longitude and latitude are NaN, as this is required later
     listings_df = listings_df.dropna(subset=['longitude', 'latitude'])
@@ -519,9 +639,13 @@ def split_by_gcc(listings_df, output_dir, data_name):
     greater_melb_pd = combined_df[combined_df['GCC_NAME21'] == "Greater Melbourne"]
     rest_of_vic_pd = combined_df[combined_df['GCC_NAME21'] == "Rest of Vic."]
     
-    # Save to CSV
-    greater_melb_pd.to_csv(f"{out_dir}/gm_{data_name}.csv")
-    rest_of_vic_pd.to_csv(f"{out_dir}/rv_{data_name}.csv")
+    # Save to CSV or parquet
+    if file_format == 'parquet':
+        greater_melb_pd.to_parquet(f"{out_dir}/gm_{data_name}.parquet", index=False)
+        rest_of_vic_pd.to_parquet(f"{out_dir}/rv_{data_name}.parquet", index=False)
+    else:
+        greater_melb_pd.to_csv(f"{out_dir}/gm_{data_name}.csv")
+        rest_of_vic_pd.to_csv(f"{out_dir}/rv_{data_name}.csv")
     
     return
 
@@ -1,74 +1,216 @@
-## Python script with functions to aid in preprocessing the oldlisting datasets in csv format ##
+## Python script with functions to aid in preprocessing the oldlisting datasets ##
 
-from datetime import datetime
+import os
 import json
+import re
 import pandas as pd
 import numpy as np
+import pyarrow.dataset as ds
+from tqdm import tqdm
 
 
+# Finds the parts of a listed price in one pass: a range ("$300 - $350"), the first price, and
+# the words after the price ("per week"). Each part is a lookahead that skips ahead lazily from
+# the start, so it matches at the same place as searching for it on its own would
+PRICE_PATTERN = re.compile(
+    r"^(?=(?:.*?(?P<low>\$\d{1,3}(?:,\d{3})*|\d+)\s*-\s*(?P<high>\$\d{1,3}(?:,\d{3})*|\d+))?)"
+    r"(?=(?:.*?\$?(?P<price>\d+(?:,\d{3})*|\d+))?)"
+    r"(?=(?:.*?\s+(?P<suffix>[a-zA-Z\s]+)$)?)",
+    re.DOTALL)
 
-def preprocess_olist(read_dir, out_dir, datasets):
+# Suffixes for each price frequency, in the order they are checked
+PRICE_FREQUENCY_PATTERNS = {'week': 'week|pw|wk', 'month': 'month|pcm', 'year': 'annum|pa|annual',
+                            'season': 'season|seasonally'}
+
+# Number of weeks in each price frequency
+PRICE_CONVERSION_FACTORS = {'week': 1, 'month': 4.333, 'year': 52, 'season': 13}
+
+# Splits an address into an optional unit ("3/" or "unit 3"), the street number (which can be a
+# range like "12-14", or have a letter like "12a") and the street name
+ADDRESS_PATTERN = re.compile(
+    r"^\s*(?:(?:unit|apartment|apt|flat|suite|shop)\s*(?P<unit_word>[\w-]+)\s+|(?P<unit_number>[\w-]+)\s*/\s*)?"
+    r"(?P<street_number>\d+[a-z]?(?:\s*-\s*\d+[a-z]?)?)\s+(?P<street_name>\d*[a-z](?:.*\S)?)\s*$",
+    re.IGNORECASE)
+
+# Short form of each street type, so "main street" and "main st" are the same street
+STREET_TYPES = {'street': 'st', 'road': 'rd', 'avenue': 'ave', 'av': 'ave', 'drive': 'dr', 'court': 'ct',
+                'crescent': 'cres', 'place': 'pl', 'parade': 'pde', 'boulevard': 'blvd', 'highway': 'hwy',
+                'lane': 'ln', 'terrace': 'tce', 'close': 'cl', 'grove': 'gr', 'circuit': 'cct',
+                'square': 'sq', 'esplanade': 'esp'}
+STREET_TYPE_PATTERN = re.compile(r"\b(" + "|".join(STREET_TYPES) + r")$")
+
+# Columns of the oldlisting datasets with a list of values for each property
+LIST_COLUMNS = ['dates', 'price_str']
+
+# Year given to listing dates that are missing or can't be parsed (written as "0000" before)
+UNKNOWN_YEAR = 0
+
+
+
+def preprocess_olist(read_dir, out_dir, datasets, chunk_size=None):
     '''
     This function applies all the necessary steps to preprocess the property
-    data from oldlistings.com
+    data from oldlistings.com. If a chunk_size is given, each dataset is streamed
+    through the steps chunk_size listings at a time and appended to its output,
+    so only one chunk is held in memory at once
     '''
     
     # Applies preprocessing steps to all datasets
     for i, region in enumerate(datasets):
 
         print(f"\n{i+1}. Preprocessing {region}...\n")
-            
-        # Step 1: Read in dataframe
-        listings_df = pd.read_csv(f"{read_dir}{region}")
 
+        # Saving the finalised dataframes into their respective directories
+        out_path = f"{out_dir}gm_oldlisting_final.csv" if region.startswith('gm_') else f"{out_dir}rv_oldlisting_final.csv"
+
+        if chunk_size is None:
+            # Step 1: Read in dataframe
+            listings_df = read_listings(f"{read_dir}{region}")
+
+            # Steps 2-10
+            listings_df = preprocess_listings(listings_df)
+            listings_df.to_csv(out_path, index=False)
+            continue
+
+        # Step 1: Read in the dataframe a chunk at a time, keeping the hashes of the rows seen
+        # so far to drop duplicates across chunks
+        seen_rows = set()
+        temp_path = f"{out_path}.tmp"
+        written = False
+        for chunk_df in tqdm(iter_listings(f"{read_dir}{region}", chunk_size)):
+
+            # Steps 2-10, then append to the output (writing to a temporary file first, so an
+            # interrupted run never leaves a partial output behind)
+            chunk_df = preprocess_listings(chunk_df, seen_rows)
+            if chunk_df.empty:
+                continue
+            chunk_df.to_csv(temp_path, mode='a' if written else 'w', header=not written, index=False)
+            written = True
+
+        if written:
+            os.replace(temp_path, out_path)
+        else:
+            print(f"No listings left in {region} after preprocessing")
+    
+    return
 
-        # Step 2: Drops any index columns that were added on when opening and saving dataset previously
-        cols_to_remove = [col for col in listings_df.columns if "Unnamed:" in col]
-        listings_df = listings_df.drop(cols_to_remove, axis=1)
 
 
-        # Step 3: Dropping duplicates rows
-        listings_df = listings_df.drop_duplicates()  # nothing gets dropped but will keep this anyways
-        
+def preprocess_listings(listings_df, seen_rows=None):
+    '''
+    Applies steps 2-10 of preprocess_olist to a dataframe of listings (a whole dataset or
+    one chunk of it) and returns the processed dataframe. When processing in chunks,
+    seen_rows is the set of row hashes from earlier chunks (see drop_duplicate_listings)
+    '''
 
-        # Step 4: Lowercasing all the values that are strings
-        listings_df = lowercase_string_attributes(listings_df) # only lowercases 3 cols. There are more string cols
+    # Step 2: Drops any index columns that were added on when opening and saving dataset previously
+    cols_to_remove = [col for col in listings_df.columns if "Unnamed:" in col]
+    listings_df = listings_df.drop(cols_to_remove, axis=1)
 
 
-        # Step 5: Formatting suburb names for readability
-        listings_df["suburb"] = listings_df["suburb"].str.replace("+", " ")
+    # Step 3: Dropping duplicates rows
+    listings_df = drop_duplicate_listings(listings_df, seen_rows)  # nothing gets dropped but will keep this anyways
+    
 
+    # Step 4: Lowercasing all the values that are strings
+    listings_df = lowercase_string_attributes(listings_df) # only lowercases 3 cols. There are more string cols
 
-        # Step 6: Converting dates from [yyyy, MM] to [yyyy]
-        listings_df["year"] = listings_df['dates'].apply(preprocess_dates)
 
+    # Step 5: Formatting suburb names for readability
+    listings_df["suburb"] = listings_df["suburb"].str.replace("+", " ")
 
-        # Step 7: Handling incorrect or missing values for no. of beds, baths and parking spaces
-        listings_df = preprocess_bbp(listings_df)
 
+    # Step 6: Handling incorrect or missing values for no. of beds, baths and parking spaces
+    listings_df = preprocess_bbp(listings_df)
 
-        # Step 8: Formatting address into "House No., Street Name"
-        listings_df = preprocess_address(listings_df) # need to add 1 more line to remove comma from end of street names
+    # Nothing left to process (e.g. a chunk with only duplicates)
+    if listings_df.empty:
+        return listings_df
 
 
-        # Step 9: Filtering the house types
-        listings_df = preprocess_house_type(listings_df)
+    # Step 7: Formatting address into "House No., Street Name"
+    listings_df = preprocess_address(listings_df) # need to add 1 more line to remove comma from end of street names
 
 
-        # Step 10: Converting price to weekly cost
-        listings_df = get_weekly_price(listings_df)
+    # Step 8: Filtering the house types
+    listings_df = preprocess_house_type(listings_df)
 
-        # These only for spark dataframes??
-        #listings_df.show()
-        #listings_df.printSchema()
 
-        # Saving the finalised dataframes into their respective directories
-        if region == 'gm_c+a_oldlisting.csv':
-            listings_df.to_csv(f"{out_dir}gm_oldlisting_final.csv", index=False)
-        else:
-            listings_df.to_csv(f"{out_dir}rv_oldlisting_final.csv", index=False)
-    
-    return
+    # Step 9: Converting price to weekly cost
+    listings_df = get_weekly_price(listings_df)
+
+
+    # Step 10: Converting dates from "Month yyyy" to yyyy
+    listings_df['date_available'] = preprocess_dates(listings_df['date_available'])
+
+    # These only for spark dataframes??
+    #listings_df.show()
+    #listings_df.printSchema()
+
+    return listings_df
+
+
+
+def read_listings(path):
+    '''
+    Reads an oldlisting dataset with its dates and prices as lists, from parquet or from an
+    older csv where the lists were stringified
+    '''
+
+    if not path.endswith('.csv'):
+        return pd.read_parquet(path)
+
+    return parse_list_columns(pd.read_csv(path))
+
+
+
+def iter_listings(path, chunk_size):
+    '''
+    Reads an oldlisting dataset like read_listings, but yields it as dataframes of up to
+    chunk_size rows. Parquet is read a row group at a time, so very large parquet files
+    should be written with a row_group_size to keep memory bounded
+    '''
+
+    if path.endswith('.csv'):
+        for chunk_df in pd.read_csv(path, chunksize=chunk_size):
+            yield parse_list_columns(chunk_df)
+        return
+
+    for batch in ds.dataset(path, format='parquet').to_batches(batch_size=chunk_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+
+def parse_list_columns(listings_df):
+    '''
+    Parses the stringified lists in the LIST_COLUMNS of a dataframe read from csv
+    '''
+
+    for col in LIST_COLUMNS:
+        listings_df[col] = listings_df[col].map(parse_list)
+    return listings_df
+
+
+
+def drop_duplicate_listings(listings_df, seen_rows=None):
+    '''
+    Drops the duplicate rows of the given dataframe, comparing the list columns by their
+    contents (drop_duplicates can't compare lists). If a set seen_rows is given, rows whose
+    hash is already in it are dropped as well, and the hashes of the kept rows are added
+    '''
+
+    list_cols = [col for col in LIST_COLUMNS if col in listings_df.columns]
+    hashable_df = listings_df.assign(**{col: listings_df[col].map(tuple, na_action='ignore') for col in list_cols})
+    if seen_rows is None:
+        return listings_df[~hashable_df.duplicated()]
+
+    # Hash each row into a single 64 bit number, far smaller to keep than the rows themselves
+    row_hashes = pd.util.hash_pandas_object(hashable_df, index=False).to_numpy()
+    already_seen = np.array([row_hash in seen_rows for row_hash in row_hashes.tolist()], dtype=bool)
+    keep = ~hashable_df.duplicated().to_numpy() & ~already_seen
+    seen_rows.update(row_hashes[keep].tolist())
+    return listings_df[keep]
 
 
 
@@ -155,99 +297,133 @@ def preprocess_house_type(df):
 def preprocess_address(listings_df):
     '''
     Handles the address column of the given dataframe and returns the 
-    processed dataframe
+    processed dataframe, with the address also split into 'unit_number',
+    'street_number' and 'street_name' columns (see parse_addresses)
     '''
 
-    # Use the suburb to create a regex pattern and remove it from the address
-    listings_df['address'] = listings_df.apply(lambda row: row['address'].replace(row['suburb'], ''), axis=1)
+    # Remove the suburb from the address. The suburb is different on every row, so this is
+    # a plain loop over both columns rather than a row-wise apply
+    listings_df['address'] = [address.replace(suburb, '') if isinstance(address, str) and isinstance(suburb, str) else address
+                              for address, suburb in zip(listings_df['address'], listings_df['suburb'])]
     
     # Remove remaining comma that separates suburb and address
-    listings_df['address'] = listings_df['address'].str.replace(',', '', regex=True)
+    listings_df['address'] = listings_df['address'].str.replace(',', '', regex=False)
     
     # Adding a flag column 'is_unit' to indicate addresses that are units (contains '/')
-    listings_df['unit'] = listings_df['address'].apply(lambda x: '/' in x)
+    listings_df['unit'] = listings_df['address'].str.contains('/', regex=False).fillna(False).astype(bool)
+
+    # Split the address into its parts, so listings can be matched on them
+    parsed_df = parse_addresses(listings_df['address'])
+    listings_df[parsed_df.columns] = parsed_df
 
     return listings_df
 
 
 
-def get_weekly_price(listings_df):
+def parse_addresses(addresses):
     '''
-    Converts the price column into weekly price for the given dataframe
-    and then returns the processed dataframe
+    Splits a series of lowercase addresses (without the suburb) like "3/12a main street"
+    into a dataframe with 'unit_number' ("3"), 'street_number' ("12a") and 'street_name'
+    ("main st"), with street types shortened so they match however they were written.
+    Addresses that don't start with a street number are left as NaN
     '''
 
-    # Step 1: Normalize JSON-like strings in 'price_str' and parse them into Python lists
-    listings_df['price_str'] = listings_df['price_str'].apply(lambda x: json.loads(x.replace("'", '"')))
+    parts = addresses.str.extract(ADDRESS_PATTERN)
+
+    # Normalise the spacing and street type of the street name
+    street_names = parts['street_name'].str.replace(r'\s+', ' ', regex=True).str.strip()
+    street_names = street_names.str.replace(STREET_TYPE_PATTERN, lambda match: STREET_TYPES[match.group(1)], regex=True)
+
+    return pd.DataFrame({
+        'unit_number': parts['unit_number'].fillna(parts['unit_word']),
+        'street_number': parts['street_number'].str.replace(' ', '', regex=False),
+        'street_name': street_names
+    }, index=addresses.index)
+
+
+
+def get_weekly_price(listings_df, average_ranges=False):
+    '''
+    Converts the price column into weekly price for the given dataframe
+    and then returns the processed dataframe, with a row for each date the property was
+    listed. The 'dates' and 'price_str' columns must be lists (see read_listings). Ranged
+    prices are dropped unless average_ranges is set (see extract_weekly_prices)
+    '''
 
-    # Step 2: Explode 'dates' and 'price_str' into row-wise combinations
+    # Step 1: Explode 'dates' and 'price_str' into row-wise combinations
     df_flattened = listings_df.explode(['dates', 'price_str']).reset_index(drop=True)
     
     # Rename exploded columns for clarity
     df_flattened.rename(columns={'dates': 'date_available', 'price_str': 'ind_price_str'}, inplace=True)
+
+    # Step 2: Convert each distinct price string to a weekly price once, then map it back onto
+    # every row (missing prices have code -1)
+    codes, price_strs = pd.factorize(df_flattened.pop('ind_price_str'))
+    weekly_costs = extract_weekly_prices(pd.Series(price_strs, dtype=object), average_ranges)
+    df_flattened['weekly_cost'] = np.append(weekly_costs, np.nan)[codes]
     
-    # Define regex patterns
-    range_pattern = r'(\$\d{1,3}(?:,\d{3})*|\d+)\s*-\s*(\$\d{1,3}(?:,\d{3})*|\d+)'
-    price_pattern = r'\$?(\d+(?:,\d{3})*|\d+)'
-    suffix_pattern = r'\s+([a-zA-Z\s]+)$'
-
-    # Step 3: Extract price information
-    df_flattened['range'] = df_flattened['ind_price_str'].str.extract(range_pattern)[0]
-    df_flattened['single_price'] = df_flattened['ind_price_str'].str.extract(price_pattern)[0]
-    df_flattened['suffix'] = df_flattened['ind_price_str'].str.extract(suffix_pattern)[0]
-
-    # Step 4: Calculate average price if a range is given, otherwise take the single price
-    df_flattened['avg_price'] = np.where(df_flattened['range'].notna(),
-                                         (df_flattened['range'].str.split('-').str[0].replace('[\$,]', '', regex=True).astype(float) +
-                                          df_flattened['range'].str.split('-').str[1].replace('[\$,]', '', regex=True).astype(float)) / 2,
-                                         df_flattened['single_price'].replace('[\$,]', '', regex=True).astype(float))
-
-    # Step 5: Classify price frequency based on the suffix
-    conditions = [
-        df_flattened['suffix'].str.contains('week|pw|wk', case=False, na=False),
-        df_flattened['suffix'].str.contains('month|pcm', case=False, na=False),
-        df_flattened['suffix'].str.contains('annum|pa|annual', case=False, na=False),
-        df_flattened['suffix'].str.contains('season|seasonally', case=False, na=False),
-        (df_flattened['suffix'].isna() | df_flattened['suffix'].str.strip() == '') & (df_flattened['avg_price'] >= 50000)
-    ]
-    choices = ['week', 'month', 'year', 'season', 'sale']
-    df_flattened['classification'] = np.select(conditions, choices, default='other')
-
-    # Step 6: Convert all prices to weekly prices based on the classification
-    conversion_factors = {'week': 1, 'month': 4.333, 'year': 52, 'season': 13}
-    df_flattened['weekly_cost'] = df_flattened.apply(
-        lambda row: row['avg_price'] / conversion_factors.get(row['classification'], np.nan) if row['classification'] in conversion_factors else np.nan,
-        axis=1
-    )
-    
-    # Step 7: If there are properties with multiple listings within a year, take the most recent price 
+    # Step 3: If there are properties with multiple listings within a year, take the most recent price 
     #df_flattened = df_flattened.loc[df_flattened.groupby(['address', 'date_available'])['month'].idxmax()]
     
-    # Step 8: Drop intermediate columns and filter out unwanted classifications
-    columns_to_drop = ['range', 'single_price', 'suffix', 'ind_price_str', 'avg_price', 'classification']
-    df_flattened = df_flattened.drop(columns=columns_to_drop)
-    df_flattened = df_flattened.dropna(subset=['weekly_cost'])  # Filter out rows where weekly price could not be calculated
+    # Step 4: Filter out rows where weekly price could not be calculated (sales and prices with an unknown frequency)
+    df_flattened = df_flattened.dropna(subset=['weekly_cost'])
     return df_flattened
 
 
 
-def preprocess_dates(date_str):
+def extract_weekly_prices(price_strs, average_ranges=False):
+    '''
+    Returns an array with the weekly price of each price string in the given series, or NaN
+    if the price or how often it is paid is unknown. Ranges ("$300 - $350 pw") are NaN as
+    well, as they always have been, unless average_ranges is set to price them at the
+    average of both ends
+    '''
+
+    # Step 1: Extract the range, first price and suffix of every string in one regex pass
+    parts = price_strs.str.extract(PRICE_PATTERN)
+
+    # Step 2: Calculate average price if a range is given, otherwise take the single price
+    amounts = parts[['low', 'high', 'price']].replace(r'[\$,]', '', regex=True).astype(float)
+    range_prices = (amounts['low'] + amounts['high']) / 2 if average_ranges else np.nan
+    avg_prices = np.where(amounts['low'].notna(), range_prices, amounts['price'])
+
+    # Step 3: Classify price frequency based on the suffix, and look up the number of weeks
+    # in each period (sales and anything else are left as NaN)
+    conditions = [parts['suffix'].str.contains(pattern, case=False, na=False)
+                  for pattern in PRICE_FREQUENCY_PATTERNS.values()]
+    weeks = np.select(conditions, list(PRICE_CONVERSION_FACTORS.values()), default=np.nan)
+
+    # Step 4: Convert all prices to weekly prices
+    return avg_prices / weeks
+
+
+
+def parse_list(value):
     '''
-    Handles the date column of the given dataframe and returns just the dataframe
-    with only the year as the value
+    Parses a stringified list like "['June 2019', 'May 2019']" into a list, returning NaN if
+    it can't be parsed. Values that aren't strings are returned as they are
     '''
 
-    if not isinstance(date_str, str):
-        return ["0000"]
+    if not isinstance(value, str):
+        return value
     try:
         # Replace single quotes with double quotes to make it valid JSON
-        json_string = date_str.replace("'", '"')
-        # Parse the JSON string to a Python list
-        dates = json.loads(json_string)
-        # Convert each date string to "yyyy" format
-        return [datetime.strptime(date, "%B %Y").strftime("%Y") for date in dates]
+        return json.loads(value.replace("'", '"'))
     except json.JSONDecodeError:
-        return ["0000"]
-    except ValueError:
-        return ["0000"]
+        return np.nan
+
+
+
+def preprocess_dates(dates):
+    '''
+    Converts a series of "Month yyyy" listing dates (one per row, after exploding the date
+    lists) into integer years, with UNKNOWN_YEAR for dates that are missing or can't be parsed
+    '''
+
+    # Only a few hundred distinct months exist, so parse each one once and map it back onto
+    # every row (missing dates have code -1)
+    codes, unique_dates = pd.factorize(dates)
+    years = pd.to_datetime(pd.Series(unique_dates, dtype=object), format="%B %Y", errors='coerce').dt.year
+    years = np.append(years.fillna(UNKNOWN_YEAR).to_numpy(), UNKNOWN_YEAR).astype('int16')
 
+    return pd.Series(years[codes], index=dates.index, name=dates.name)
@@ -0,0 +1,191 @@
+## Python script with a shared per-host rate limiter for all the scrapers and API clients. Each ##
+## host gets a token bucket whose rate adapts AIMD-style: it creeps up while the server is ##
+## healthy and halves when the server pushes back with a 429, 403 or 5xx ##
+
+import time
+import asyncio
+import threading
+from urllib.parse import urlparse
+import requests
+
+
+# Starting and maximum requests per second for the hosts we scrape. Hosts not listed here are
+# not rate limited, but still back off when they return a throttling response
+HOST_LIMITS = {
+    'www.domain.com.au': {'rate': 10, 'max_rate': 40},
+    'www.oldlistings.com.au': {'rate': 0.5, 'max_rate': 2},
+    'api.openrouteservice.org': {'rate': 0.5, 'max_rate': 0.66},  # 40 matrix requests per minute
+}
+
+# Status codes that mean the server wants us to slow down
+THROTTLE_STATUSES = {403, 429}
+
+
+
+class RateLimiter:
+    '''
+    Token bucket allowing 'rate' requests per second (None for no limit) with bursts of up
+    to 'burst' requests. After every successful request the rate grows by 'increase', up to
+    'max_rate'; after a throttling response it is multiplied by 'decrease' (down to
+    'min_rate') and all requests pause for the Retry-After time or one request interval.
+    Safe to share between threads and asyncio tasks
+    '''
+
+    def __init__(self, rate=None, max_rate=None, min_rate=0.05, increase=0.05, decrease=0.5, burst=1):
+        self.rate = rate
+        self.max_rate = max_rate or rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        '''
+        Takes a token and returns how many seconds to wait before using it
+        '''
+
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.paused_until - now)
+
+            if self.rate:
+                # Top up the bucket for the time that has passed, then take a token. The bucket
+                # can go negative, which queues callers one interval apart
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.tokens -= 1
+                delay = max(delay, -self.tokens / self.rate)
+
+            return delay
+
+    def wait(self):
+        '''
+        Blocks until the next request is allowed
+        '''
+
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        '''
+        Waits (without blocking the event loop) until the next request is allowed
+        '''
+
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def record(self, status=None, retry_after=None):
+        '''
+        Updates the rate from the status code of a finished request (None for a request
+        that failed without a response, which is ignored)
+        '''
+
+        if status is None:
+            return
+
+        with self.lock:
+            if is_backoff_status(status):
+                # Multiplicative decrease, and pause everyone for a while
+                self.failures += 1
+                if self.rate:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    pause = 1 / self.rate
+                else:
+                    pause = min(60, 2 ** self.failures)
+                self.paused_until = time.monotonic() + (retry_after if retry_after is not None else pause)
+            else:
+                # Additive increase
+                self.failures = 0
+                if self.rate:
+                    self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+
+def is_backoff_status(status):
+    '''
+    Returns whether a status code means the server is throttling us or failing, so the
+    limiter should slow down
+    '''
+
+    return status in THROTTLE_STATUSES or status >= 500
+
+
+
+LIMITERS = {}
+LIMITERS_LOCK = threading.Lock()
+
+
+
+def host_of(url_or_host):
+    '''
+    Returns the host name of a url, or the value itself if it is already a host
+    '''
+
+    return urlparse(url_or_host).netloc or url_or_host
+
+
+
+def get_limiter(url_or_host):
+    '''
+    Returns the shared RateLimiter for the host of the given url, creating it from
+    HOST_LIMITS the first time the host is seen
+    '''
+
+    host = host_of(url_or_host)
+    with LIMITERS_LOCK:
+        if host not in LIMITERS:
+            LIMITERS[host] = RateLimiter(**HOST_LIMITS.get(host, {}))
+        return LIMITERS[host]
+
+
+
+def configure_host(url_or_host, **settings):
+    '''
+    Sets the rate limiter settings (see RateLimiter) for a host, replacing its current limiter
+    '''
+
+    host = host_of(url_or_host)
+    with LIMITERS_LOCK:
+        HOST_LIMITS[host] = settings
+        LIMITERS[host] = RateLimiter(**settings)
+
+
+
+def retry_after_seconds(headers):
+    '''
+    Returns the Retry-After header in seconds, or None if it is missing or not a number
+    '''
+
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+
+def limited_get(url, session=None, retries=1, **kwargs):
+    '''
+    Sends a GET request with requests (or the given session) once the host's rate limiter
+    allows it, then feeds the response status back into the limiter. A throttling or server
+    error response is retried up to 'retries' times (after the limiter's pause), and raises
+    an HTTPError if it still fails, so callers never mistake it for the page
+    '''
+
+    limiter = get_limiter(url)
+
+    for attempt in range(retries + 1):
+        limiter.wait()
+        response = (session or requests).get(url, **kwargs)
+        limiter.record(response.status_code, retry_after_seconds(response.headers))
+
+        if not is_backoff_status(response.status_code):
+            return response
+
+    response.raise_for_status()
@@ -0,0 +1,589 @@
+## Python script with the routing backends used to find driving distances between properties ##
+## and amenities: the Open Route Services API, or a local OSM road graph routed offline ##
+
+import os
+import hashlib
+import threading
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scripts.rate_limiter import get_limiter
+
+try:
+    from openrouteservice import Client
+except ImportError:
+    Client = None
+
+
+# Mean radius of the earth in km
+EARTH_RADIUS_KM = 6371.0088
+
+# Most sources x destinations allowed in one ORS matrix request
+MAX_MATRIX_ELEMENTS = 3500
+
+# Comma separated ORS api keys, used when none are given
+ORS_KEYS_VARIABLE = "ORS_API_KEYS"
+
+ROAD_GRAPH_PATH = "../data/raw/vic_road_graph.npz"
+
+# OSM highway types that cars can drive on, and the query for all of them in Victoria
+DRIVABLE_HIGHWAYS = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified', 'residential',
+                     'living_street', 'service', 'road', 'motorway_link', 'trunk_link', 'primary_link',
+                     'secondary_link', 'tertiary_link']
+ROAD_QUERY = ("[out:json][timeout:900];area[name='Victoria']->.searchArea;"
+              "way['highway'~'^({highways})$']['access'!~'^(private|no)$'](area.searchArea);"
+              "(._;>;);out body;")
+
+
+
+def to_unit_vectors(lats, lons):
+    '''
+    Converts latitudes and longitudes (in degrees) into points on the unit sphere, where the
+    straight line distance between two points only depends on the great-circle distance
+    between them
+    '''
+
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lons = np.radians(np.asarray(lons, dtype=float))
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+
+def chords_to_km(chords):
+    '''
+    Converts straight line distances between points on the unit sphere into great-circle
+    distances in km (the line between two points is 2*sin(angle/2) long)
+    '''
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chords, dtype=float) / 2, 0, 1))
+
+
+
+############################################ BACKENDS ############################################
+
+class RoutingBackend:
+    '''
+    Base for the ways of finding driving distances. 'profile' names the backend's distances
+    in the distance cache, so distances from different backends are never mixed up
+    '''
+
+    name = None
+    profile = None
+
+    def distances(self, df, p_lat, p_lon, a_lat, a_lon, cache=None):
+        '''
+        Returns an array of the driving distance (in km, NaN where it couldn't be found)
+        between each property and amenity pair in df, saving them to the cache (if given)
+        as they are found
+        '''
+
+        raise NotImplementedError
+
+
+
+############################################ OPEN ROUTE SERVICES ############################################
+
+def number_locations(lons, lats):
+    '''
+    Returns a code for each coordinate (equal coordinates share a code) and the
+    [longitude, latitude] of each code
+    '''
+
+    locations = pd.DataFrame({'lon': np.asarray(lons, dtype=float), 'lat': np.asarray(lats, dtype=float)})
+    codes = locations.groupby(['lon', 'lat'], sort=False, dropna=False).ngroup().to_numpy()
+    first = np.unique(codes, return_index=True)[1]
+    return codes, locations.iloc[first].to_numpy().tolist()
+
+
+
+def plan_matrix_batches(origin_codes, dest_codes, max_elements=MAX_MATRIX_ELEMENTS):
+    '''
+    Packs pairs (given by the codes of their origin and destination) into matrix requests,
+    each with sources x destinations of at most max_elements. Returns the positions of the
+    pairs in each request. Pairs are grouped by destination, so a request can hold up to
+    max_elements pairs rather than one per source
+    '''
+
+    origin_codes = np.asarray(origin_codes)
+    dest_codes = np.asarray(dest_codes)
+
+    # Group the pairs by destination, largest groups first
+    order = np.argsort(dest_codes, kind='stable')
+    groups = np.split(order, np.flatnonzero(np.diff(dest_codes[order])) + 1) if len(order) else []
+    groups.sort(key=len, reverse=True)
+
+    batches = []  # positions of the pairs in each full request
+    open_batches = []  # [positions, set of source codes, number of destinations] of the others
+    for group in groups:
+
+        # A destination with more pairs than fit in one request gets full requests of its own
+        while len(group) > max_elements:
+            batches.append(group[:max_elements])
+            group = group[max_elements:]
+
+        # Add the rest to the first request it fits in, or start a new one
+        sources = set(origin_codes[group].tolist())
+        for batch in open_batches:
+            if (len(batch[1]) + len(sources - batch[1])) * (batch[2] + 1) <= max_elements:
+                batch[0] = np.concatenate([batch[0], group])
+                batch[1] |= sources
+                batch[2] += 1
+                break
+        else:
+            open_batches.append([group, sources, 1])
+
+    return batches + [batch[0] for batch in open_batches]
+
+
+
+def fetch_batch_distances(df, api_keys, p_lat, p_lon, a_lat, a_lon, max_elements=MAX_MATRIX_ELEMENTS, profile='driving-car',
+                          cache=None):
+    '''
+    Makes batch api calls to Open Route Services to calculate the driving distance between
+    each property and amenity pair given, and returns the distances of each pair. Pairs are
+    packed into many-to-many matrix requests (see plan_matrix_batches), and each successful
+    batch is saved to the cache, if one is given
+    '''
+
+    # Initialising the return array and api key index
+    all_distances = np.full(len(df), np.nan)
+    current_key = 0
+
+    # Number the distinct properties and amenities, then plan the requests
+    origin_codes, origins = number_locations(df[p_lon], df[p_lat])
+    dest_codes, destinations = number_locations(df[a_lon], df[a_lat])
+    batches = plan_matrix_batches(origin_codes, dest_codes, max_elements)
+    print(f"Requesting {len(df)} distances in {len(batches)} matrix requests")
+
+    # Setting the client to make api calls with the given api key. Throttling is left to the
+    # shared ORS rate limiter instead of the client's own fixed retry wait
+    client = Client(key=api_keys[current_key], retry_over_query_limit=False)
+    limiter = get_limiter('api.openrouteservice.org')
+    
+    # Loops through the planned batches one request at a time
+    for i, positions in enumerate(batches):
+        
+        # Prepare coordinates: first the distinct properties, then the distinct amenities, and
+        # where each pair's distance is in the matrix
+        batch_sources = np.unique(origin_codes[positions])
+        batch_dests = np.unique(dest_codes[positions])
+        coords = [origins[code] for code in batch_sources] + [destinations[code] for code in batch_dests]
+        rows = np.searchsorted(batch_sources, origin_codes[positions])
+        cols = np.searchsorted(batch_dests, dest_codes[positions])
+        
+        # Error handling variables
+        retries = 0  # Track retries for a batch
+        max_retries = 3  # Limit retries to avoid infinite loops
+
+        while retries < max_retries:
+            try:
+                # Wait for the rate limiter, then make the ORS Matrix API request for driving distances
+                limiter.wait()
+                matrix = client.distance_matrix(
+                    locations=coords, 
+                    profile=profile,
+                    metrics=['distance'],
+                    sources=list(range(len(batch_sources))),  # Property indices
+                    destinations=list(range(len(batch_sources), len(coords)))  # Amenity indices
+                )
+                limiter.record(200)
+                
+                # Get driving distances of the pairs in this batch
+                batch_distances = []
+                for row, col in zip(rows, cols):
+                    distance = matrix['distances'][row][col]  # Property to amenity distance
+
+                    if isinstance(distance, (int, float)):
+                        batch_distances.append(distance / 1000)  # Convert from meters to kilometers
+                    else:
+                        batch_distances.append(None)
+                all_distances[positions] = np.array(batch_distances, dtype=float)
+                break # Successfully completed this batch, move to next batch
+
+            except Exception as e:
+                print(f"Error with batch {i+1}: {e}")
+
+                # Handle error in calculation
+                if 'unsupported operand type' in str(e):
+                    print("Cannot complete batch request on this set of properties. Skipping to next batch.\n")
+                    retries=max_retries
+                # Handle daily limit exceeded
+                elif "403" in str(e) and "Quota exceeded" in str(e):
+                    print(f"Quota limit exceeded for API key {api_keys[current_key]}")
+                    current_key += 1  # Switch to the next API key
+
+                    if current_key >= len(api_keys):
+                        print("All API keys exhausted. Stopping the API calls...\n")
+                        return [None if np.isnan(distance) else distance for distance in all_distances]  # Exit if all keys are exhausted
+                    
+                    # Set new API key and retry
+                    client = Client(key=api_keys[current_key], retry_over_query_limit=False)
+                    print("Using a new key...")
+                    retries += 1  # Increment retries counter
+
+                # Handle rate limit exceeded (403 or 429), the limiter slows down and pauses before the retry
+                elif "403" in str(e) or "429" in str(e):
+                    print("Rate limit exceeded. Backing off...")
+                    limiter.record(getattr(e, 'status', None) or 429)
+                    retries += 1  # Increment retries counter
+
+                # Handle other errors (e.g., HTTP 502), server errors also make the limiter back off
+                else:
+                    print(f"Unexpected error occurred: {e}.\nRetrying...")
+                    limiter.record(getattr(e, 'status', None))
+                    retries += 1  # Increment retries counter
+
+        # If retries exceeded max_retries, leave this batch as None
+        if retries>=max_retries:
+            print(f"Maximum retries reached for batch {i+1}, skipping to next batch...\n")
+
+        # Otherwise save the distances, so these pairs are never requested again
+        elif cache is not None:
+            batch = df.iloc[positions]
+            cache.store(batch[p_lat], batch[p_lon], batch[a_lat], batch[a_lon], batch_distances, profile)
+    
+    return [None if np.isnan(distance) else distance for distance in all_distances]
+
+
+
+class ORSBackend(RoutingBackend):
+    '''
+    Routes through the Open Route Services matrix api, rotating through 'api_keys' (or the
+    comma separated keys in the ORS_API_KEYS environment variable) as their daily quotas
+    run out. Requests are paced by the shared ORS rate limiter
+    '''
+
+    name = "ors"
+
+    def __init__(self, api_keys=None, profile='driving-car', max_elements=MAX_MATRIX_ELEMENTS):
+        if Client is None:
+            raise ImportError("The ors routing backend needs the openrouteservice package")
+        if not api_keys:
+            api_keys = [key.strip() for key in os.environ.get(ORS_KEYS_VARIABLE, '').split(',') if key.strip()]
+        if not api_keys:
+            raise ValueError(f"No ORS api keys given, pass api_keys or set {ORS_KEYS_VARIABLE}")
+
+        self.api_keys = list(api_keys)
+        self.profile = profile
+        self.max_elements = max_elements
+
+    def distances(self, df, p_lat, p_lon, a_lat, a_lon, cache=None):
+        return np.array(fetch_batch_distances(df, self.api_keys, p_lat, p_lon, a_lat, a_lon, self.max_elements,
+                                              self.profile, cache), dtype=float)
+
+
+
+############################################ LOCAL ROAD GRAPH ############################################
+
+class RoadGraph:
+    '''
+    Directed road network: nodes with their coordinates, and edges weighted by their length
+    in km (two way roads have an edge each way). Kept as sparse matrices both ways round,
+    so shortest paths can be searched forwards from a property or backwards from an amenity,
+    and a KD-tree of the nodes for snapping coordinates onto the network. 'fingerprint' is a
+    hash of the nodes and edges, which changes whenever the network does
+    '''
+
+    def __init__(self, node_lats, node_lons, edge_from, edge_to, edge_km):
+        self.node_lats = np.asarray(node_lats, dtype=float)
+        self.node_lons = np.asarray(node_lons, dtype=float)
+        n = len(self.node_lats)
+
+        # Keep only the shortest of any parallel edges (a sparse matrix would add them up) and
+        # drop loops back onto the same node
+        edge_from = np.asarray(edge_from, dtype=np.int64)
+        edge_to = np.asarray(edge_to, dtype=np.int64)
+        edge_km = np.asarray(edge_km, dtype=float)
+        order = np.lexsort((edge_km, edge_to, edge_from))
+        keys = edge_from[order] * n + edge_to[order]
+        keep = order[np.r_[True, keys[1:] != keys[:-1]] & (edge_from[order] != edge_to[order])]
+        self.edge_from, self.edge_to, self.edge_km = edge_from[keep], edge_to[keep], edge_km[keep]
+
+        # Zero weights count as missing edges, so nodes at the same spot get a tiny length instead
+        weights = np.maximum(self.edge_km, 1e-9)
+        self.forward = csr_matrix((weights, (self.edge_from, self.edge_to)), shape=(n, n))
+        self.backward = self.forward.T.tocsr()
+        self.tree = cKDTree(to_unit_vectors(self.node_lats, self.node_lons))
+
+        digest = hashlib.sha256()
+        for array in (self.node_lats, self.node_lons, self.edge_from, self.edge_to, self.edge_km):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        self.fingerprint = digest.hexdigest()[:16]
+
+    @classmethod
+    def load(cls, path=ROAD_GRAPH_PATH):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No road graph at {path}, download one with fetch_road_graph first")
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+    def save(self, path=ROAD_GRAPH_PATH):
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # Write to a temporary file first, so an interrupted write never leaves a broken graph
+        with open(f"{path}.tmp", 'wb') as f:
+            np.savez_compressed(f, node_lats=self.node_lats, node_lons=self.node_lons, edge_from=self.edge_from,
+                                edge_to=self.edge_to, edge_km=self.edge_km)
+        os.replace(f"{path}.tmp", path)
+
+    def snap(self, lats, lons, max_km=None):
+        '''
+        Returns the nearest node to each coordinate and the great-circle distance (in km) to
+        it, with -1 and NaN for coordinates that are missing or further than max_km from
+        every node
+        '''
+
+        points = to_unit_vectors(lats, lons)
+        valid = np.isfinite(points).all(axis=1)
+        nodes = np.full(len(points), -1, dtype=np.int64)
+        snap_km = np.full(len(points), np.nan)
+
+        chords, found = self.tree.query(points[valid])
+        nodes[valid] = found
+        snap_km[valid] = chords_to_km(chords)
+
+        if max_km is not None:
+            too_far = ~(snap_km <= max_km)
+            nodes[too_far] = -1
+            snap_km[too_far] = np.nan
+        return nodes, snap_km
+
+
+
+def road_graph_from_ways(ways):
+    '''
+    Builds a RoadGraph from OSM ways (as returned by overpy), following their oneway tags.
+    Motorways and roundabouts are one way unless tagged otherwise
+    '''
+
+    node_index = {}
+    node_lats, node_lons = [], []
+    edge_from, edge_to = [], []
+
+    for way in ways:
+        nodes = []
+        for node in way.nodes:
+            if node.id not in node_index:
+                node_index[node.id] = len(node_lats)
+                node_lats.append(float(node.lat))
+                node_lons.append(float(node.lon))
+            nodes.append(node_index[node.id])
+
+        implied = 'yes' if way.tags.get('highway') == 'motorway' or way.tags.get('junction') == 'roundabout' else 'no'
+        oneway = way.tags.get('oneway', implied)
+        if oneway == '-1':
+            nodes = nodes[::-1]  # one way against the direction the way is drawn
+
+        edge_from.extend(nodes[:-1])
+        edge_to.extend(nodes[1:])
+        if oneway not in ('yes', 'true', '1', '-1'):
+            edge_from.extend(nodes[1:])
+            edge_to.extend(nodes[:-1])
+
+    node_lats = np.array(node_lats, dtype=float)
+    node_lons = np.array(node_lons, dtype=float)
+    edge_from = np.array(edge_from, dtype=np.int64)
+    edge_to = np.array(edge_to, dtype=np.int64)
+
+    # Each edge is a straight segment of the way
+    chords = np.linalg.norm(to_unit_vectors(node_lats[edge_from], node_lons[edge_from])
+                            - to_unit_vectors(node_lats[edge_to], node_lons[edge_to]), axis=1)
+    return RoadGraph(node_lats, node_lons, edge_from, edge_to, chords_to_km(chords))
+
+
+
+def fetch_road_graph(api, path=ROAD_GRAPH_PATH, highways=DRIVABLE_HIGHWAYS):
+    '''
+    Downloads the drivable roads in Victoria through the Overpass API, and saves them as the
+    road graph used by the local routing backend. Only needs to be run once, the graph is
+    read from disk after that
+    '''
+
+    print("Downloading the road network, this can take a while...")
+    result = api.query(ROAD_QUERY.format(highways='|'.join(highways)))
+    graph = road_graph_from_ways(result.ways)
+    graph.save(path)
+    print(f"Saved {len(graph.node_lats)} nodes and {len(graph.edge_km)} edges to {path}")
+
+    with ROAD_GRAPHS_LOCK:
+        ROAD_GRAPHS[path] = (os.path.getmtime(path), graph)
+
+    return graph
+
+
+
+ROAD_GRAPHS = {}
+ROAD_GRAPHS_LOCK = threading.Lock()
+
+
+
+def get_road_graph(path=ROAD_GRAPH_PATH):
+    '''
+    Returns the RoadGraph stored at path, shared by every caller in this process (and
+    re-read if the file has changed since)
+    '''
+
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    with ROAD_GRAPHS_LOCK:
+        cached = ROAD_GRAPHS.get(path)
+        if cached is None or cached[0] != mtime:
+            ROAD_GRAPHS[path] = (mtime, RoadGraph.load(path))
+        return ROAD_GRAPHS[path][1]
+
+
+
+def route_from_starts(graph_path, reverse, starts, start_positions, ends, detour_factor=None):
+    '''
+    Runs Dijkstra from each of the start nodes over the road graph at graph_path (backwards
+    along every edge if reverse), and returns the network distance (in km, NaN if there is no
+    route) of each pair, given by the position of its start in starts and its end node. Each
+    search stops at detour_factor times the great-circle distance to its furthest end (and
+    is rerun in full if that misses any of them). Used by the worker processes, which each
+    load the graph once
+    '''
+
+    graph = get_road_graph(graph_path)
+    matrix = graph.backward if reverse else graph.forward
+    km = np.full(len(ends), np.nan)
+
+    # One search at a time, so only one row of distances to every node is held at once
+    for position, start in enumerate(starts):
+        pairs = np.flatnonzero(start_positions == position)
+        pair_ends = ends[pairs]
+
+        limit = np.inf
+        if detour_factor is not None:
+            chords = np.linalg.norm(to_unit_vectors(graph.node_lats[pair_ends], graph.node_lons[pair_ends])
+                                    - to_unit_vectors(graph.node_lats[[start]], graph.node_lons[[start]]), axis=1)
+            limit = detour_factor * chords_to_km(chords).max() + 1  # plus a km so very short trips can detour
+
+        found = dijkstra(matrix, directed=True, indices=start, limit=limit)[pair_ends]
+        if np.isinf(found).any() and np.isfinite(limit):
+            found = dijkstra(matrix, directed=True, indices=start)[pair_ends]
+
+        found[np.isinf(found)] = np.nan
+        km[pairs] = found
+
+    return km
+
+
+
+class LocalGraphBackend(RoutingBackend):
+    '''
+    Routes over an OSM road graph on disk (see fetch_road_graph), so no api keys, quotas or
+    network access are needed. Each coordinate is snapped to its nearest road node (within
+    max_snap_km), and the great-circle distance to that node is added at both ends. The
+    shortest paths are found with one Dijkstra search per distinct start node, searching from
+    whichever side of the pairs has fewer distinct nodes (usually backwards from the
+    amenities), with 'chunk_size' searches at a time spread across 'workers' processes (one
+    per core by default, 1 to run in this process). Each search only explores up to
+    detour_factor times the great-circle distance to its furthest end (None for no limit).
+    Cached distances are tied to the graph's fingerprint, so fetching a new graph never
+    reuses distances from the old one
+    '''
+
+    name = "local"
+
+    def __init__(self, graph_path=ROAD_GRAPH_PATH, max_snap_km=1.0, workers=None, chunk_size=32, detour_factor=3.0):
+        self.graph_path = graph_path
+        self.max_snap_km = max_snap_km
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.detour_factor = detour_factor
+
+    @property
+    def profile(self):
+        # Distances depend on the graph, so each version of it gets its own entries in the cache
+        graph = get_road_graph(self.graph_path)
+        return f"local-{os.path.splitext(os.path.basename(self.graph_path))[0]}-{graph.fingerprint}"
+
+    def distances(self, df, p_lat, p_lon, a_lat, a_lon, cache=None):
+        graph = get_road_graph(self.graph_path)
+        distances = np.full(len(df), np.nan)
+
+        # Snap both ends of every pair onto the road network
+        origin_nodes, origin_km = graph.snap(df[p_lat], df[p_lon], self.max_snap_km)
+        dest_nodes, dest_km = graph.snap(df[a_lat], df[a_lon], self.max_snap_km)
+        routable = np.flatnonzero((origin_nodes >= 0) & (dest_nodes >= 0))
+
+        # Search from the side with fewer distinct nodes, backwards if starting from the amenities
+        reverse = len(np.unique(dest_nodes[routable])) <= len(np.unique(origin_nodes[routable]))
+        start_nodes, end_nodes = (dest_nodes, origin_nodes) if reverse else (origin_nodes, dest_nodes)
+        starts, start_codes = np.unique(start_nodes[routable], return_inverse=True)
+        print(f"Routing {len(routable)} distances from {len(starts)} {'amenity' if reverse else 'property'} nodes "
+              f"({len(df) - len(routable)} pairs couldn't be snapped to a road)")
+
+        # Split the start nodes into chunks, with the pairs starting from each chunk
+        order = np.argsort(start_codes, kind='stable')
+        bounds = np.searchsorted(start_codes[order], np.arange(0, len(starts) + self.chunk_size, self.chunk_size))
+        chunks = []
+        for i in range(len(bounds) - 1):
+            if bounds[i] < bounds[i + 1]:
+                in_chunk = order[bounds[i]:bounds[i + 1]]
+                chunks.append((routable[in_chunk], starts[i * self.chunk_size:(i + 1) * self.chunk_size],
+                               start_codes[in_chunk] - i * self.chunk_size))
+
+        # Run the searches, in worker processes unless there is only one worker
+        args = ([chunk[1] for chunk in chunks], [chunk[2] for chunk in chunks], [end_nodes[chunk[0]] for chunk in chunks],
+                repeat(self.detour_factor))
+        if self.workers == 1:
+            executor = None
+            results = map(route_from_starts, repeat(self.graph_path), repeat(reverse), *args)
+        else:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+            results = executor.map(route_from_starts, repeat(self.graph_path), repeat(reverse), *args)
+
+        try:
+            for (positions, _, _), network_km in tqdm(zip(chunks, results), total=len(chunks)):
+                distances[positions] = origin_km[positions] + network_km + dest_km[positions]
+
+                # Save each chunk as it finishes, so an interrupted run keeps its progress
+                if cache is not None:
+                    batch = df.iloc[positions]
+                    cache.store(batch[p_lat], batch[p_lon], batch[a_lat], batch[a_lon], distances[positions], self.profile)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # Pairs too far from any road are saved too, so they aren't tried again
+        unroutable = np.setdiff1d(np.arange(len(df)), routable)
+        if cache is not None and len(unroutable):
+            batch = df.iloc[unroutable]
+            cache.store(batch[p_lat], batch[p_lon], batch[a_lat], batch[a_lon], distances[unroutable], self.profile)
+
+        return distances
+
+
+
+############################################ REGISTRY ############################################
+
+ROUTING_BACKENDS = {
+    ORSBackend.name: ORSBackend,
+    LocalGraphBackend.name: LocalGraphBackend
+}
+
+DEFAULT_ROUTING_BACKEND = "ors"
+
+
+
+def get_routing_backend(backend=None, **params):
+    '''
+    Returns a new routing backend given its name ('ors' or 'local') and any backend
+    parameters, an existing backend, or an ORS backend for a list of api keys, defaulting
+    to DEFAULT_ROUTING_BACKEND
+    '''
+
+    if backend is None:
+        backend = DEFAULT_ROUTING_BACKEND
+    if isinstance(backend, str):
+        return ROUTING_BACKENDS[backend](**params)
+    if isinstance(backend, (list, tuple)):
+        return ORSBackend(api_keys=backend, **params)
+    return backend
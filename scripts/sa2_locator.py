@@ -0,0 +1,135 @@
+## Python script with a reusable SA2 region lookup for listing coordinates, using a cached ##
+## Victoria-only set of SA2 polygons and an STRtree spatial index ##
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely import STRtree
+
+
+SA2_SHAPEFILE = "../data/SA2/SA2_extracted/SA2_2021_AUST_GDA2020.shp"
+SA2_CACHE = "../data/SA2/vic_sa2_2021.parquet"
+
+# The SA2 columns kept for each listing
+SA2_COLUMNS = ['SA2_CODE21', 'SA2_NAME21', 'GCC_NAME21', 'AREASQKM21']
+
+
+
+def load_vic_sa2(shapefile=SA2_SHAPEFILE, cache_path=SA2_CACHE):
+    '''
+    Returns the Victorian SA2 polygons with the SA2_COLUMNS. The first call reads the full
+    Australian shapefile and saves the Victorian part as GeoParquet, which later calls read
+    instead (until the shapefile changes). The polygons stay in the shapefile's GDA2020
+    latitude/longitude rather than being projected, see SA2Locator
+    '''
+
+    if os.path.exists(cache_path) and (not os.path.exists(shapefile)
+                                       or os.path.getmtime(cache_path) >= os.path.getmtime(shapefile)):
+        return gpd.read_parquet(cache_path)
+
+    sf = gpd.read_file(shapefile) # read SA2 shapefile
+    sf = sf[sf['STE_NAME21'] == 'Victoria'] # remove all instances not in victoria
+    sf = sf[SA2_COLUMNS + ['geometry']].reset_index(drop=True)
+
+    # Write to a temporary file first, so an interrupted write never leaves a broken cache
+    sf.to_parquet(f"{cache_path}.tmp")
+    os.replace(f"{cache_path}.tmp", cache_path)
+
+    return sf
+
+
+
+class SA2Locator:
+    '''
+    Finds the SA2 region containing each coordinate. The polygons are loaded once and indexed
+    in an STRtree, so each point is only tested against the few polygons whose bounding boxes
+    contain it. Results are memoised per coordinate rounded to 'precision' decimal places
+    (6 places is about 10cm), so repeated addresses skip the geometry test entirely.
+    Safe to share between threads.
+
+    The polygons and points are deliberately left in latitude/longitude instead of a metric
+    CRS. 'within' only compares positions, not distances, so nothing needs metres. The
+    listings' coordinates are already latitude/longitude, so no points need transforming.
+    It also keeps the exact edges of the previous sjoin: projecting would bend each polygon
+    edge slightly and could move points lying near a border into the other region
+    '''
+
+    def __init__(self, shapefile=SA2_SHAPEFILE, cache_path=SA2_CACHE, precision=6):
+        self.regions = load_vic_sa2(shapefile, cache_path)
+        self.tree = STRtree(self.regions.geometry.values)
+        self.precision = precision
+        self.memo = {}
+        self.lock = threading.Lock()
+
+    def locate(self, longitudes, latitudes):
+        '''
+        Returns the row of self.regions containing each coordinate, or -1 for coordinates
+        outside every SA2 region
+        '''
+
+        scale = 10 ** self.precision
+        lons = np.round(np.asarray(longitudes, dtype=float) * scale)
+        lats = np.round(np.asarray(latitudes, dtype=float) * scale)
+        located = np.full(len(lons), -1, dtype=np.int64)
+
+        # Pack each rounded coordinate into one integer key, so each distinct coordinate is only
+        # looked up once (missing coordinates stay at -1)
+        valid = np.isfinite(lons) & np.isfinite(lats)
+        offset = 2 ** 31
+        keys = ((lons[valid].astype(np.int64) + offset).astype(np.uint64) << np.uint64(32)) \
+               | (lats[valid].astype(np.int64) + offset).astype(np.uint64)
+        codes, unique_keys = pd.factorize(keys)
+
+        with self.lock:
+            found = np.array([self.memo.get(key, -2) for key in unique_keys.tolist()], dtype=np.int64)
+
+        # Test the coordinates that haven't been seen before against the tree
+        new = np.flatnonzero(found == -2)
+        if len(new):
+            new_keys = unique_keys[new]
+            new_lons = ((new_keys >> np.uint64(32)).astype(np.int64) - offset) / scale
+            new_lats = ((new_keys & np.uint64(2 ** 32 - 1)).astype(np.int64) - offset) / scale
+            point_idx, region_idx = self.tree.query(gpd.points_from_xy(new_lons, new_lats), predicate='within')
+
+            # A point on a shared border can be within two regions, keep the lowest numbered one
+            order = np.lexsort((region_idx, point_idx))
+            first_points, first = np.unique(point_idx[order], return_index=True)
+            regions = np.full(len(new), -1, dtype=np.int64)
+            regions[first_points] = region_idx[order][first]
+            found[new] = regions
+
+            with self.lock:
+                self.memo.update(zip(new_keys.tolist(), regions.tolist()))
+
+        located[valid] = found[codes]
+        return located
+
+    def sa2_attributes(self, longitudes, latitudes, index=None):
+        '''
+        Returns a dataframe with the SA2_COLUMNS of the region containing each coordinate
+        (NaN outside every region)
+        '''
+
+        found = self.locate(longitudes, latitudes)
+        attributes = self.regions[SA2_COLUMNS].reindex(found)
+        attributes.index = index if index is not None else pd.RangeIndex(len(found))
+        return attributes
+
+
+
+LOCATORS = {}
+LOCATORS_LOCK = threading.Lock()
+
+
+
+def get_sa2_locator(shapefile=SA2_SHAPEFILE, cache_path=SA2_CACHE):
+    '''
+    Returns the SA2Locator for the given shapefile, shared by every caller in this process
+    '''
+
+    with LOCATORS_LOCK:
+        if shapefile not in LOCATORS:
+            LOCATORS[shapefile] = SA2Locator(shapefile, cache_path)
+        return LOCATORS[shapefile]
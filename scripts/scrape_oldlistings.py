@@ -6,7 +6,11 @@ import pandas as pd
 import os
 import re
 import numpy as np
-import time
+import pyarrow as pa
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from scripts.rate_limiter import limited_get, THROTTLE_STATUSES
 
 
 
@@ -84,331 +88,313 @@ def scrape_postcodes(url):
 
 
 
+##### FUNCTIONS TO CRAWL OLDLISTINGS.COM #####
+
+# Need this header to access the data
+HEADERS = {'User-Agent': (f"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+            f"(KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0"),
+           'referer': "https://www.oldlistings.com.au/"}
+
+SUBURB_URL = "https://www.oldlistings.com.au/real-estate/VIC/{suburb}/{postcode}/rent/"
+POSTCODES_PATH = "../data/landing/postcodes/postcodes.csv"
+OUT_DIR = "../data/landing/oldlisting/"
+DATASET_NAME = "oldlisting.parquet"
+COMPLETED_NAME = "completed_suburbs.csv"
+MAX_PAGES = 50
+
+# Column types of the scraped dataset. The dates and prices are lists with an entry for each
+# time the property was listed
+OLDLISTING_SCHEMA = pa.schema([
+    ('suburb', pa.string()),
+    ('postcode', pa.int32()),
+    ('address', pa.string()),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('beds', pa.float64()),
+    ('baths', pa.float64()),
+    ('cars', pa.float64()),
+    ('house_type', pa.string()),
+    ('dates', pa.list_(pa.string())),
+    ('price_str', pa.list_(pa.string()))
+])
+
+
+
+class BlockedError(Exception):
+    '''
+    Raised when oldlistings.com keeps refusing requests, so the crawl should stop and be
+    resumed later
+    '''
+
+
+
+def fetch_oldlisting_page(url, max_retries=3):
+    '''
+    Fetches a page from oldlistings.com through the shared rate limiter, retrying throttled
+    requests (the limiter backs off before each retry). Returns the parsed page, or None if
+    the page doesn't exist
+    '''
+
+    for _ in range(max_retries):
+        try:
+            response = limited_get(url, retries=0, headers=HEADERS)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code in THROTTLE_STATUSES:
+                continue  # Throttled, the limiter pauses before the next attempt
+            raise
+
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()  # Ensure the request was successful
+        return BeautifulSoup(response.text, 'html.parser')
+
+    raise BlockedError(f"Still blocked after {max_retries} attempts at {url}")
+
+
+
+def get_num_pages(soup):
+    '''
+    Reads the number of result pages for a suburb from its first page, or returns 0 if the
+    suburb has no listings
+    '''
+
+    # Find the <p> tag containing number of records for the suburb
+    p_tag = soup.find('p', class_='sub-page-h2')
+    if not p_tag:
+        return 0
+
+    # Get number of records
+    num_records = int(re.findall(r'\d+', p_tag.text)[-1])
+    records_per_page = float(re.findall(r'\d+', p_tag.text)[1])
+    return int(np.ceil(num_records/records_per_page))
+
+
+
+def parse_oldlisting_properties(soup, suburb_name, postcode):
+    '''
+    Extracts the features of every property on a page of oldlistings results: 'suburb',
+    'postcode', 'address', 'latitude', 'longitude', 'beds', 'baths', 'cars', 'house_type',
+    'dates' and 'price_str' (the last two are lists, one entry per time it was listed)
+    '''
+
+    # Find all properties
+    property_classes = ['property odd clearfix', 'property even clearfix']
+    properties = soup.find_all('div', class_=lambda x: x in property_classes)
+
+    properties_list = []
+    for property in properties:
+
+        # Extract latitude and longitude
+        latitude = property.get('data-lat', 'N/A')
+        longitude = property.get('data-lng', 'N/A')
+
+        # Extract address
+        address_tag = property.find('h2', class_='address')
+        address = address_tag.text.strip() if address_tag else 'N/A'
+
+        # Extract number of beds, baths, cars and the house type
+        meta = {}
+        for feature in ['bed', 'bath', 'car', 'type']:
+            tag = property.find('p', class_=f'property-meta {feature}')
+            meta[feature] = tag.find('span').next_sibling.strip() if tag else 'N/A'
+
+        # Extract dates and prices
+        dates = []
+        prices = []
+        for li in property.find_all('li'):
+            span = li.find('span')
+            if span:
+                dates.append(span.text.strip())
+                prices.append(li.text.replace(span.text, '').strip())
+
+        properties_list.append({
+            'suburb': suburb_name,
+            'postcode': postcode,
+            'address': address,
+            'latitude': latitude,
+            'longitude': longitude,
+            'beds': meta['bed'],
+            'baths': meta['bath'],
+            'cars': meta['car'],
+            'house_type': meta['type'],
+            'dates': dates,
+            'price_str': prices
+        })
+
+    return properties_list
+
+
+
+def scrape_suburb(suburb_name, postcode, max_pages=MAX_PAGES):
+    '''
+    Scrapes every page of rental listings (up to max_pages) for a suburb and returns the
+    list of properties. A page that fails to download raises, so the suburb is left to be
+    scraped again instead of being saved with pages missing
+    '''
+
+    url = SUBURB_URL.format(suburb=suburb_name, postcode=postcode)
+    soup = fetch_oldlisting_page(url)
+    if soup is None:
+        print(f"Error 404: Not found {url}. Continuing with other URLs.")
+        return []
+
+    num_pages = min(get_num_pages(soup), max_pages)
+
+    properties_list = []
+    for page_num in range(1, num_pages + 1):
+        page = fetch_oldlisting_page(f"{url}{page_num}")
+        if page is not None:
+            properties_list.extend(parse_oldlisting_properties(page, suburb_name, postcode))
+
+    return properties_list
+
+
+
+def to_oldlisting_frame(properties_list):
+    '''
+    Converts a list of scraped properties into a dataframe with the columns of
+    OLDLISTING_SCHEMA, with features that weren't found ('N/A') as NaN
+    '''
+
+    df = pd.DataFrame(properties_list, columns=OLDLISTING_SCHEMA.names)
+
+    for col in ['postcode', 'latitude', 'longitude', 'beds', 'baths', 'cars']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in ['address', 'house_type']:
+        df[col] = df[col].mask(df[col] == 'N/A')
+
+    return df
+
+
+
+def completed_suburbs(out_dir=OUT_DIR):
+    '''
+    Returns the set of (suburb, postcode) pairs that have already been scraped
+    '''
+
+    path = os.path.join(out_dir, COMPLETED_NAME)
+    if not os.path.exists(path):
+        return set()
+
+    done_df = pd.read_csv(path)
+    return set(zip(done_df['suburb'], done_df['postcode']))
+
+
+
+def save_suburb(properties_list, suburb_name, postcode, out_dir=OUT_DIR):
+    '''
+    Writes the properties for a suburb as its own part file of the parquet dataset (see
+    mark_completed for recording that the suburb is done)
+    '''
+
+    dataset_dir = os.path.join(out_dir, DATASET_NAME)
+    if not os.path.exists(dataset_dir):
+        os.makedirs(dataset_dir, exist_ok=True)
+
+    if properties_list:
+        # Write to a temporary file first, so an interrupted write never leaves half a part behind
+        # (the name starts with a dot so readers of the dataset skip it)
+        part_name = f"part-{postcode}-{suburb_name}.parquet"
+        temp_path = os.path.join(dataset_dir, f".{part_name}.tmp")
+        to_oldlisting_frame(properties_list).to_parquet(temp_path, index=False, schema=OLDLISTING_SCHEMA)
+        os.replace(temp_path, os.path.join(dataset_dir, part_name))
+
+
+
+def mark_completed(suburb_name, postcode, out_dir=OUT_DIR):
+    '''
+    Records that a suburb has been scraped and saved, so later crawls skip it. Only call it
+    from one thread, as the appends to the completed file aren't locked
+    '''
+
+    completed_path = os.path.join(out_dir, COMPLETED_NAME)
+    write_header = not os.path.exists(completed_path)
+    pd.DataFrame({'suburb': [suburb_name], 'postcode': [postcode]}) \
+        .to_csv(completed_path, mode='a', header=write_header, index=False)
+
+
+
+def crawl_oldlistings(suburbs_df=None, out_dir=OUT_DIR, max_workers=4, max_pages=MAX_PAGES):
+    '''
+    NOTE: oldlistings.com has since changed its format, so this may no longer find listings.
+    Scrapes historical rental data from oldlistings.com for every suburb in suburbs_df (the
+    scraped postcodes by default), 'max_workers' suburbs at a time. All requests share the
+    oldlistings rate limiter, so adding workers never exceeds the site's request rate. Each
+    suburb is saved as its own part of out_dir/oldlisting.parquet as soon as it finishes (and
+    marked completed from this thread), and suburbs already completed are skipped, so the
+    crawl can be rerun until it finishes
+    '''
+
+    if suburbs_df is None:
+        suburbs_df = prep_suburb_names(pd.read_csv(POSTCODES_PATH))
+
+    # Only crawl the suburbs that haven't been completed in earlier runs
+    done = completed_suburbs(out_dir)
+    todo = [(suburb, postcode) for suburb, postcode in zip(suburbs_df['suburb'], suburbs_df['postcode'])
+            if (suburb, postcode) not in done]
+    print(f"{len(suburbs_df) - len(todo)} suburbs already scraped, {len(todo)} to go")
+
+    blocked = threading.Event()
+
+    def crawl_suburb(suburb_name, postcode):
+        # Don't start any new suburbs once the site has blocked us. Returns whether the
+        # suburb was saved
+        if blocked.is_set():
+            return False
+        try:
+            properties_list = scrape_suburb(suburb_name, postcode, max_pages)
+        except BlockedError as e:
+            blocked.set()
+            print(f"Unfortunately you've been blocked: {e}")
+            return False
+        except requests.exceptions.RequestException as e:
+            print(f"Network-related error occurred for {suburb_name}, leaving it for the next run: {e}")
+            return False
+        save_suburb(properties_list, suburb_name, postcode, out_dir)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(crawl_suburb, suburb, postcode): (suburb, postcode) for suburb, postcode in todo}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            # Only this thread writes to the completed file, so its rows never interleave
+            if future.result():
+                mark_completed(*futures[future], out_dir)
+
+    remaining = len(suburbs_df) - len(completed_suburbs(out_dir))
+    if remaining:
+        print(f"{remaining} suburbs still to scrape, please run again later to continue")
+
+
+
+def read_oldlisting_data(out_dir=OUT_DIR, suburbs=None, columns=None):
+    '''
+    Reads the scraped parts of the oldlistings parquet dataset into one dataframe, optionally
+    only the given suburbs and columns (the other row groups and columns are never read)
+    '''
+
+    filters = [('suburb', 'in', list(suburbs))] if suburbs is not None else None
+    return pd.read_parquet(os.path.join(out_dir, DATASET_NAME), columns=columns, filters=filters)
+
+
+
 def get_oldlisting_data():
     """
     DEPRECATED AS OLDLISTINGS HAS CHANGED ITS FORMAT:
-    Scrapes historical property data from oldlistings.com, and saves as a .csv for each property 
-    with the following features: 'suburb', 'postcode', 'address' 'latitude', 'longitude', 'beds', 
-    'baths', 'cars', 'house_type', 'dates', 'price_str'. 
+    Scrapes historical property data from oldlistings.com, see crawl_oldlistings
     """
 
-    # Need this header to access the data
-    headers = {'User-Agent': (f"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                f"(KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0"),
-               'referer': "https://www.oldlistings.com.au/"}
-    
-    
-    read_dir = "../data/landing/postcodes/postcodes.csv"
-    suburbs_df = pd.read_csv(read_dir)
-    suburbs_df = prep_suburb_names(suburbs_df)
-    
-    # List to hold all property data
-    properties_list = []
-    for index, suburb in suburbs_df.iterrows():
-        suburb_name = suburb['suburb']
-        postcode = suburb['postcode']
-        print(f"Getting data for {suburb_name}, {postcode}. Suburb {index} of {len(suburbs_df)}")
-        
-        url_template = \
-            f"https://www.oldlistings.com.au/real-estate/VIC/{suburb_name}/{postcode}/rent/"
-            
-        
-        try:
-            # Fetch the webpage
-            response = requests.get(url_template, headers=headers)
-            response.raise_for_status()  # Ensure the request was successful
-
-            # Parse the HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Find the <p> tag containing number of records for the suburb
-            p_tag = soup.find('p', class_='sub-page-h2')
-
-            # Extract and print the text if the tag is found 
-            if p_tag:
-                # Get number of records
-                num_records = int(re.findall(r'\d+', p_tag.text)[-1])
-                records_per_page = float(re.findall(r'\d+', p_tag.text)[1])
-                num_pages = int(np.ceil(num_records/records_per_page))
-                print(f"num pages: {num_pages}")
-            else:
-                print("No listings found. Continuing with other URLS.")
-                return
-
-            # Only iterate through the first 50 pages per suburb maximum
-            for page_num in range(1, min([num_pages + 1, 50])):
-                time.sleep(2)
-                url = \
-                    f"https://www.oldlistings.com.au/real-estate/VIC/{suburb_name}/{postcode}/rent/{page_num}"
-                try:
-                    # Fetch the webpage
-                    response = requests.get(url, headers=headers)
-                    response.raise_for_status()  # Ensure the request was successful
-
-                    # Parse the HTML content
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    # Find all properties
-                    property_classes = ['property odd clearfix', 'property even clearfix']
-                    properties = soup.find_all('div', class_=lambda x: x in property_classes)
-                    
-                    # Extract data from each property
-                    for property in properties:
-                        
-                        # Extract Latitude and Longitude
-                        latitude = property.get('data-lat', 'N/A')
-                        longitude = property.get('data-lng', 'N/A')
-                        
-                        # Extract address
-                        address_tag = property.find('h2', class_='address')
-                        address = address_tag.text.strip() if address_tag else 'N/A'
-                        
-                        # Extract number of beds
-                        beds_tag = property.find('p', class_='property-meta bed')
-                        num_beds = beds_tag.find('span').next_sibling.strip() if beds_tag else 'N/A'
-                        
-                        # Extract number of baths
-                        baths_tag = property.find('p', class_='property-meta bath')
-                        num_baths = baths_tag.find('span').next_sibling.strip() if baths_tag else 'N/A'
-                        
-                        # Extract number of cars
-                        cars_tag = property.find('p', class_='property-meta car')
-                        num_cars = cars_tag.find('span').next_sibling.strip() if cars_tag else 'N/A'
-                        
-                        # Extract house type
-                        type_tag = property.find('p', class_='property-meta type')
-                        house_type = type_tag.find('span').next_sibling.strip() if type_tag else 'N/A'
-                        
-                        # Extract dates and prices
-                        dates = []
-                        prices = []
-                        for li in property.find_all('li'):
-                            span = li.find('span')
-                            if span:
-                                date = span.text.strip()
-                                price = li.text.replace(span.text, '').strip()
-                                dates.append(date)
-                                prices.append(price)
-
-                        # Append the extracted data to the list
-                        properties_list.append({
-                            'suburb': suburb_name,
-                            'postcode': postcode,
-                            'address': address,
-                            'latitude': latitude,
-                            'longitude': longitude,
-                            'beds': num_beds,
-                            'baths': num_baths,
-                            'cars': num_cars,
-                            'house_type': house_type,
-                            'dates': dates,
-                            'price_str': prices
-                            
-                        })
-                except:
-                    continue
-            
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                print(f"Error 404: Not found {url_template}. Continuing with other URLs.")
-            elif e.response.status_code == 403:
-                print(f"Unfortunately you've been blocked")
-                print(f"Saving progres... please try again later")
-                
-                # Save whatever data has been collected
-                oldlisting_df = pd.DataFrame(properties_list)
-                out_dir = "../data/landing/oldlisting/"
-                if not os.path.exists(out_dir):
-                    os.makedirs(out_dir)
-                oldlisting_df.to_csv(f"{out_dir}oldlisting.csv", index=False)
-                
-                # Save which suburb scraper was up to
-                
-                # Filter the DataFrame to include only the specified suburb and all that follow
-                remaining_suburbs_df = suburbs_df[suburbs_df['suburb'] >= suburb_name]
-
-                # Save the filtered DataFrame to a new CSV file
-                remaining_suburbs_df.to_csv(f"{out_dir}remaining_suburbs.csv", index=False)
-                return
-            else:
-                print(f"HTTP error occurred: {e}")  # Handle other types of HTTP errors
-        except requests.exceptions.RequestException as e:
-            print(f"Network-related error occurred: {e}")
-          
-    oldlisting_df = pd.DataFrame(properties_list)
-    out_dir = "../data/landing/oldlisting/"
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    oldlisting_df.to_csv(f"{out_dir}oldlisting.csv", index=False)
-    return
-    
+    crawl_oldlistings()
+
 
 
 def get_remaining_oldlisting_data():
     """
     DEPRECATED AS OLDLISTINGS HAS CHANGED ITS FORMAT:
-    Scrapes the remaining suburbs from oldlisting, will save the newly written listing data into a 
-    .csv and automatically update which suburbs are unscraped - function can be rerun multiple times
-    to scrape all data
+    Scrapes the suburbs that haven't been completed yet, see crawl_oldlistings (which
+    resumes automatically)
     """
 
-    # Need this header to access the data
-    headers = {'User-Agent': (f"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                f"(KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0"),
-               'referer': "https://www.oldlistings.com.au/"}
-    
-    
-    read_dir = "../data/landing/oldlisting/"
-    suburbs_df = pd.read_csv(f"{read_dir}remaining_suburbs.csv")
-    suburbs_df = prep_suburb_names(suburbs_df)
-
-    prev_data_df = pd.read_csv(f"{read_dir}oldlisting.csv")
-    
-    # List to hold all property data
-    properties_list = []
-    for index, suburb in suburbs_df.iterrows():
-        
-        suburb_name = suburb['suburb']
-        postcode = suburb['postcode']
-        print(f"Getting data for {suburb_name}, {postcode}. Suburb {index} of {len(suburbs_df)}")
-        
-        url_template = \
-            f"https://www.oldlistings.com.au/real-estate/VIC/{suburb_name}/{postcode}/rent/"
-            
-        
-        try:
-            # Fetch the webpage
-            response = requests.get(url_template, headers=headers)
-            response.raise_for_status()  # Ensure the request was successful
-
-            # Parse the HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Find the <p> tag containing number of records for the suburb
-            p_tag = soup.find('p', class_='sub-page-h2')
-
-            # Extract and print the text if the tag is found 
-            if p_tag:
-                # Get number of records
-                num_records = int(re.findall(r'\d+', p_tag.text)[-1])
-                records_per_page = float(re.findall(r'\d+', p_tag.text)[1])
-                num_pages = int(np.ceil(num_records/records_per_page))
-                print(f"num pages: {num_pages}")
-            else:
-                print("No listings found. Continuing with other URLS.")
-                return
-            
-
-            for page_num in range(1 , min([num_pages+1, 51])):
-                time.sleep(2)
-                url = \
-                    f"https://www.oldlistings.com.au/real-estate/VIC/{suburb_name}/{postcode}/rent/{page_num}"
-                try:
-                    # Fetch the webpage
-                    response = requests.get(url, headers=headers)
-                    response.raise_for_status()  # Ensure the request was successful
-
-                    # Parse the HTML content
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    # Find all properties
-                    property_classes = ['property odd clearfix', 'property even clearfix']
-                    properties = soup.find_all('div', class_=lambda x: x in property_classes)
-                    
-                    # Extract data from each property
-                    for property in properties:
-                        
-                        # Extract Latitude and Longitude
-                        # Extract latitude and longitude
-                        latitude = property.get('data-lat', 'N/A')
-                        longitude = property.get('data-lng', 'N/A')
-                        
-                        # Extract address
-                        address_tag = property.find('h2', class_='address')
-                        address = address_tag.text.strip() if address_tag else 'N/A'
-                        
-                        # Extract number of beds
-                        beds_tag = property.find('p', class_='property-meta bed')
-                        num_beds = beds_tag.find('span').next_sibling.strip() if beds_tag else 'N/A'
-                        
-                        # Extract number of baths
-                        baths_tag = property.find('p', class_='property-meta bath')
-                        num_baths = baths_tag.find('span').next_sibling.strip() if baths_tag else 'N/A'
-                        
-                        # Extract number of cars
-                        cars_tag = property.find('p', class_='property-meta car')
-                        num_cars = cars_tag.find('span').next_sibling.strip() if cars_tag else 'N/A'
-                        
-                        # Extract house type
-                        type_tag = property.find('p', class_='property-meta type')
-                        house_type = type_tag.find('span').next_sibling.strip() if type_tag else 'N/A'
-                        
-                        # Extract dates and prices
-                        dates = []
-                        prices = []
-                        for li in property.find_all('li'):
-                            span = li.find('span')
-                            if span:
-                                date = span.text.strip()
-                                price = li.text.replace(span.text, '').strip()
-                                dates.append(date)
-                                prices.append(price)
-
-                        # Append the extracted data to the list
-                        properties_list.append({
-                            'suburb': suburb_name,
-                            'postcode': postcode,
-                            'address': address,
-                            'latitude': latitude,
-                            'longitude': longitude,
-                            'beds': num_beds,
-                            'baths': num_baths,
-                            'cars': num_cars,
-                            'house_type': house_type,
-                            'dates': dates,
-                            'price_str': prices
-                            
-                        })
-                except:
-                    continue
-            
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                print(f"Error 404: Not found {url_template}. Continuing with other URLs.")
-            elif e.response.status_code == 403:
-                print(f"Unfortunately you've been blocked")
-                print(f"Saving progress... please try again later")
-                
-                # Save whatever data has been collected
-                newdata_df = pd.DataFrame(properties_list)
-                combined_data_df = pd.concat([prev_data_df, newdata_df], ignore_index=True)
-                
-                out_dir = "../data/landing/oldlisting/"
-                if not os.path.exists(out_dir):
-                    os.makedirs(out_dir)
-                combined_data_df.to_csv(f"{out_dir}oldlisting.csv", index=False)
-                
-                # Save which suburb scraper was up to
-                
-                # Filter the DataFrame to include only the specified suburb and all that follow
-                remaining_suburbs_df = suburbs_df[suburbs_df['suburb'] >= suburb_name]
-
-                # Save the filtered DataFrame to a new CSV file
-                remaining_suburbs_df.to_csv(f"{out_dir}remaining_suburbs.csv", index=False)
-                
-                print(f"{index} more suburbs added in this run")
-                return
-            else:
-                print(f"HTTP error occurred: {e}")  # Handle other types of HTTP errors
-        except requests.exceptions.RequestException as e:
-            print(f"Network-related error occurred: {e}")
-           
-    newdata_df = pd.DataFrame(properties_list)
-    combined_data_df = pd.concat([prev_data_df, newdata_df], ignore_index=True)
-    
-    out_dir = "../data/landing/oldlisting/"
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
-    combined_data_df.to_csv(f"{out_dir}oldlisting.csv", index=False)
-    return
+    crawl_oldlistings()
 
 
 
@@ -0,0 +1,6 @@
+## Lets the tests import the scripts package from the repo root ##
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,84 @@
+## Tests for the domain preprocessing functions ##
+
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.preproccessing import extract_weekly_cost, extract_weekly_costs
+
+
+# Cost texts of every kind extract_weekly_cost handles, and the edge cases around them
+COST_TEXTS = [
+    # Weekly
+    "$450 per week", "$450pw", "$1,250.50 p/w", "$600 p.w.", "$380 week", "$700 weekly", "Rent $520 PER WEEK",
+    # Annual
+    "$26,000 p.a.", "$31,200 pa", "$40,000 per annum", "$52,000 per year", "$18,000 annual", "$9,100 year",
+    # Monthly
+    "$2,000 p/m", "$1,800 month", "$1,950 pm", "$2,100 p.m.", "$1,200 per month",
+    # Seasonal
+    "Season $2,600", "$3,900 for the season", "seasonal $1,300", "$1,300 seasonally",
+    # Bare numbers
+    "$450", "450", "1,250", "$1,250.75", "  $450  ",
+    # Edge cases: newlines, padding, several prices, no price at all
+    "$450\nper week", "\n$2,000 p/m\n", "  $26,000   p.a.  ", "$450 per week or $1,950 pm",
+    "$1,950 pm, $450 per week", "Contact agent", "Deposit taken", "", " ", "$", "pw",
+]
+
+
+
+def fuzzed_cost_texts(n, seed=0):
+    '''
+    Builds n random cost texts out of prices, keywords and filler
+    '''
+
+    rng = random.Random(seed)
+    prices = ["$450", "$1,250", "$26,000.50", "450", "$0", "$,", "$1,2,3"]
+    words = ["per week", "pw", "p/w", "weekly", "p.a.", "pa", "annum", "per year", "month", "pm", "p/m",
+             "season", "seasonal", "Season", "PW", "rent", "negotiable", "\n", "  ", ""]
+    return [" ".join(rng.choice(prices + words) for _ in range(rng.randint(1, 4))) for _ in range(n)]
+
+
+
+def scalar_weekly_costs(texts):
+    # None (no price found) becomes NaN, the same as in the vectorised version
+    return np.array([np.nan if cost is None else cost for cost in map(extract_weekly_cost, texts)], dtype=float)
+
+
+
+def test_extract_weekly_costs_matches_extract_weekly_cost():
+    costs = extract_weekly_costs(pd.Series(COST_TEXTS))
+    np.testing.assert_array_equal(costs.to_numpy(), scalar_weekly_costs(COST_TEXTS))
+
+
+
+def test_extract_weekly_costs_matches_on_fuzzed_texts():
+    texts = []
+    for text in fuzzed_cost_texts(5000):
+        # Texts the scalar version can't parse are covered by the test below
+        try:
+            extract_weekly_cost(text)
+        except ValueError:
+            continue
+        texts.append(text)
+
+    costs = extract_weekly_costs(pd.Series(texts))
+    np.testing.assert_array_equal(costs.to_numpy(), scalar_weekly_costs(texts))
+
+
+
+def test_extract_weekly_costs_keeps_index_and_repeats():
+    texts = pd.Series(["$450 pw", np.nan, "$450 pw", "$26,000 pa"], index=[10, 11, 12, 13], name='cost_text')
+    costs = extract_weekly_costs(texts)
+
+    assert costs.name == 'cost_text'
+    assert list(costs.index) == [10, 11, 12, 13]
+    np.testing.assert_array_equal(costs.to_numpy(), [450, np.nan, 450, 500])
+
+
+
+def test_extract_weekly_costs_gives_nan_where_extract_weekly_cost_raises():
+    # A price without any digits can't be converted to a float
+    with pytest.raises(ValueError):
+        extract_weekly_cost("$, pw")
+
+    assert np.isnan(extract_weekly_costs(pd.Series(["$, pw"]))[0])